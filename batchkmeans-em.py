@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import datetime as dt
+import argparse
 from joblib import cpu_count
 
 import numpy as np
@@ -13,9 +14,22 @@ from libpysal.cg import voronoi_frames
 
 from herbert.base import scale_series
 import herbert.geometry as hg
+from herbert.raster import read_rasters
+from herbert.store import read_gf
 
 pd.set_option('display.max_columns', None)
 
+RASTER = False
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='cluster East Midlands gridmap population')
+    parser.add_argument('-r', dest='raster', action='store_true',
+                        help='read gridmap from GeoTIFF rasters')
+
+    args = parser.parse_args()
+    RASTER = args.raster
+
 # EPSG:4326 WG 84
 # EPSG:32630
 # EPSG:27700 OS GB36
@@ -33,15 +47,20 @@ print(f'Load {LAYER}')
 try:
     GRID
 except NameError:
-    GRID = gp.read_file(FILEPATH, layer=LAYER).to_crs(CRS)
+    if RASTER:
+        GRIDPOINTS, DATA = read_rasters(FILEPATH, LAYER, ['p'])
+        GRID = pd.DataFrame(data=DATA)
+    else:
+        GRID = read_gf(FILEPATH, LAYER, ['p'], 'centroid', CRS)
+        GRIDPOINTS = hg.get_points(GRID)
 
 LAYER = 'boundary'
 try:
     BOUNDARY
 except NameError:
-    BOUNDARY = gp.read_file(FILEPATH, layer=LAYER).to_crs(CRS)
+    BOUNDARY = read_gf(FILEPATH, LAYER, crs=CRS)
 
-POINTS = hg.get_points(GRID)
+POINTS = GRIDPOINTS
 print(dt.datetime.now() - START)
 print('Create model')
 N = 1024
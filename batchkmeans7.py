@@ -12,8 +12,9 @@ from shapely.geometry import Polygon
 from sklearn.cluster import MiniBatchKMeans
 
 from herbert.base import archive, scale_series
-from herbert.people import get_density
-from herbert.geometry import get_points
+from herbert.people import get_density, read_hierarchy
+from herbert.geometry import dissolve, get_points, get_longest_border, get_nearest, get_within
+from herbert.store import read_gf
 
 pd.set_option('display.max_columns', None)
 
@@ -33,7 +34,7 @@ print(f'Read geography {LAYER}')
 try:
     GEOGRAPHY
 except NameError:
-    GEOGRAPHY = gp.read_file(FILEPATH, layer=LAYER).to_crs(CRS)
+    GEOGRAPHY = read_gf(FILEPATH, LAYER, crs=CRS)
     POINTS = pd.DataFrame(index=GEOGRAPHY['OA'], data=get_points(GEOGRAPHY.centroid))
     POINTS['index'] = range(POINTS.shape[0])
 
@@ -84,7 +85,7 @@ print(dt.datetime.now() - START)
 
 print('Find boundaries')
 KEYS = ['area', 'population', 'geometry', 'class']
-BKM = GEOGRAPHY[KEYS].dissolve(by='class', aggfunc='sum')
+BKM = dissolve(GEOGRAPHY[KEYS], 'class', 'sum')
 print('Write boundaries')
 BKM = BKM.reset_index()
 
@@ -101,14 +102,12 @@ centres = SPLIT.loc[SPLIT.index.difference(IDX1)]
 centres['geometry'] = centres.centroid
 
 # Move centres back inside boundaries
-for k, v in BOUNDARIES.iterrows():
-    idx = centres[centres['class'] != v['class']].within(v['geometry'])
-    for m in idx[idx].index:
-        SPLIT.loc[m, 'key'] = v['class']
+IDX = get_within(centres, BOUNDARIES, 'class')
+SPLIT.loc[centres.index[IDX > -1], 'key'] = BOUNDARIES['class'].values[IDX[IDX > -1]]
 
 SPLIT['class'] = SPLIT['key']
 KEYS = ['class', 'geometry']
-BKM = SPLIT[KEYS].dissolve(by='class', aggfunc='first')
+BKM = dissolve(SPLIT[KEYS], 'class')
 BKM['area'] = BKM.area
 
 POPULATION = gp.GeoDataFrame(data=GEOGRAPHY['population'], geometry=GEOGRAPHY.centroid)
@@ -131,26 +130,20 @@ IDX1 = (SPLIT['sarea'] > 1.0E6) & (SPLIT['sarea'] < 5.0E8)
 IDX1 = IDX1[IDX1].index
 IDX2 = SPLIT.index.difference(IDX1)
 
-GF1 = SPLIT.loc[IDX2].dissolve(by='class', aggfunc='first').reset_index()
+GF1 = dissolve(SPLIT.loc[IDX2], 'class').reset_index()
 GF1['sarea'] = GF1.area
 
 GF2 = SPLIT.loc[IDX1].reset_index(drop=True)
 
 print(dt.datetime.now() - START)
-for i, region in GF2.iterrows():
-    gf = gp.GeoDataFrame([region], crs=CRS)
-    idx = GF1[GF1.touches(region['geometry'])].index
-    if len(idx) == 0:
-        continue
-    gs = GF1.loc[idx].intersection(region['geometry']).length
-    m = gs.sort_values(ascending=False).index.take([0]).values[0]
-    GF2.loc[i, 'key'] = m
+IDX = get_longest_border(GF2, GF1)
+GF2.loc[IDX > -1, 'key'] = GF1.index[IDX[IDX > -1]]
 
 GF2['class'] = GF2['key']
 
 # migrate sub-regions to closest region
 KEYS = ['class', 'geometry', 'key']
-BKM2 = pd.concat([GF1[KEYS], GF2[KEYS]]).dissolve(by='class', aggfunc='first')
+BKM2 = dissolve(pd.concat([GF1[KEYS], GF2[KEYS]]), 'class')
 
 SPLIT = BKM2.explode(index_parts=True).reset_index()
 SPLIT['sarea'] = SPLIT.area
@@ -158,16 +151,13 @@ SPLIT['sarea'] = SPLIT.area
 IDX3 = SPLIT[SPLIT['sarea'] > 1.0E8].index
 #IDX3 = SPLIT.sort_values(['class', 'sarea']).drop_duplicates(subset='class', keep='last').index
 
-GF3 = SPLIT.loc[IDX3].dissolve(by='class').reset_index()
+GF3 = dissolve(SPLIT.loc[IDX3], 'class').reset_index()
 IDX4 = SPLIT.index.difference(IDX3)
 GF4 = SPLIT.loc[IDX4]
 
-for i, region in GF4.iterrows():
-    m = GF3.distance(region['geometry'].centroid).idxmin()
-    if SPLIT.loc[i, 'class'] != GF3.loc[m, 'class']:
-        SPLIT.loc[i, 'class'] = GF3.loc[m, 'class']
+SPLIT.loc[IDX4, 'class'] = GF3['class'].values[get_nearest(GF4.centroid, GF3)]
 
-BKM2 = SPLIT.dissolve(by='class', aggfunc='first').reset_index()
+BKM2 = dissolve(SPLIT, 'class').reset_index()
 BKM2['area'] = BKM2.area
 
 GF5 = gp.sjoin(BKM2[['class', 'geometry']], POPULATION, how='left')
@@ -186,8 +176,21 @@ BKM2.to_crs(CRS).to_file(OUTPATH, driver='GPKG', layer=f'fit2 {KEY} boundary')
 print(dt.datetime.now() - START)
 print(f'Find towns {KEY}')
 
-LSOA = gp.read_file('grid.gpkg', layer='LSOA').to_crs(CRS)
-MSOA = gp.read_file('grid.gpkg', layer='MSOA').to_crs(CRS)
+GRIDPATH = 'grid.gpkg'
+GRID = read_gf(GRIDPATH, 'OA', geometry=None, schema=None)
+HIERARCHY = read_hierarchy(GRIDPATH, GRID)
+
+def get_level(level, this_frame):
+    """Return GeoDataFrame of grid level centre-points with OA rollups from the
+    grid hierarchy
+    """
+    gf = read_gf(GRIDPATH, level, [level], crs=CRS, schema=None)
+    df = HIERARCHY.get_frame(level, this_frame)
+    return gf.merge(df, on=level)
+
+LSOA = get_level('LSOA', GRID)
+MSOA = get_level('MSOA', GRID)
+del GRID
 
 KEYS = ['class', 'geometry']
 TOWNS = MSOA.sjoin(BKM2[KEYS], predicate='within').drop(columns='index_right')
@@ -10,8 +10,6 @@ import os
 os.environ['USE_PYGEOS'] = '0'
 import geopandas as gp
 
-from shapely.geometry import LineString
-
 #from scipy.spatial.distance import pdist
 
 from libpysal.weights import Delaunay
@@ -23,6 +21,8 @@ from networkx.utils import pairwise
 #from networkx.algorithms.flow import maximum_flow_value
 
 import herbert.geometry as hg
+import herbert.flow as hf
+from herbert.network import Graph, PathCache
 
 #ff08E8
 pd.set_option('display.max_columns', None)
@@ -33,6 +33,10 @@ P = 10.0E3
 REGION = 'wales'
 REGION = 'wessex'
 REGION = 'em'
+JOBS = 1
+BACKEND = 'networkx'
+CHECK = False
+WIDE = False
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(
@@ -41,8 +45,20 @@ if __name__ == '__main__':
                         nargs='?', default='em')
     parser.add_argument('-p', dest='population', type=float,
                         help='population centre', default=10.0E3)
+    parser.add_argument('-j', dest='jobs', type=int,
+                        help='number of parallel flow processes', default=1)
+    parser.add_argument('--flow', dest='backend', type=str, choices=hf.BACKENDS,
+                        help='max-flow backend', default='networkx')
+    parser.add_argument('--check-flow', dest='check', action='store_true',
+                        help='check all max-flow backends give the same pfp values')
+    parser.add_argument('-w', dest='wide', action='store_true',
+                        help='write a flow column for each commodity in legs, routes and sum')
 
     args = parser.parse_args()
+    JOBS = args.jobs
+    BACKEND = args.backend
+    CHECK = args.check
+    WIDE = args.wide
     P = args.population
     REGION = args.region
 
@@ -79,12 +95,12 @@ print('Get 1km clipped boundary')
 def get_clipped(this_gf, d1=128.0, d2=-1024.0):
     gf = this_gf.buffer(d1, single_sided=True).buffer(d2, single_sided=True)
     gf = gf.rename('geometry').reset_index()
-    return this_gf.overlay(gf, how='union').dissolve()
+    return hg.dissolve(this_gf.overlay(gf, how='union'), processes=JOBS)
 
 try:
     OUTER
 except NameError:
-    OUTER = get_clipped(BOUNDARY.dissolve())
+    OUTER = get_clipped(hg.dissolve(BOUNDARY, processes=JOBS))
 
 EXTERIOR = OUTER.explode(index_parts=False).iloc[0]['geometry']
 OUTER.to_crs(CRS).to_file(OUTPATH, driver='GPKG', layer='outer')
@@ -129,7 +145,7 @@ def get_clusters(boundary, p_index, grid, d=65536.0):
     gf1['class'] = -1
     points = hg.get_points(grid.loc[p_index])
     gf1.loc[p_index, 'class'] = agglomerate_cluster(p_index, points, d)
-    gf2 = gf1.loc[gf1['class'] >= 0, ['class', 'geometry']].dissolve(by='class')
+    gf2 = hg.dissolve(gf1.loc[gf1['class'] >= 0, ['class', 'geometry']], 'class', processes=JOBS)
     gf2 = gf2.explode(index_parts=False).reset_index()
     gf2['cluster'] = gf2.index
     gf3 = gp.sjoin(grid[['geometry', 'p']], gf2).drop(columns='index_right')
@@ -138,7 +154,7 @@ def get_clusters(boundary, p_index, grid, d=65536.0):
     #gf1.loc[gf3.index, 'cluster'] = gf3['cluster']
     gf1['cluster'] = gf3['cluster']
     fields = ['p', 'geometry', 'cluster']
-    gf1 = gf1[fields].dissolve(by='cluster', aggfunc='sum').reset_index()
+    gf1 = hg.dissolve(gf1[fields], 'cluster', 'sum', JOBS).reset_index()
     gf1['name'] = 'T' + (gf1.index + 1).map(str).str.zfill(3)
 
     gf2 = gf3.reset_index().rename(columns={'index': 'em class'})
@@ -155,33 +171,15 @@ CLUSTERS, NODES = get_clusters(ALLBOUNDARIES, pIDX, HGRID)
 CLUSTERS.to_crs(CRS).to_file(OUTPATH, driver='GPKG', layer='clusters')
 NODES.to_crs(CRS).to_file(OUTPATH, driver='GPKG', layer='nodes')
 
-def get_wnx(gx, points):
-    try:
-        edges = [LineString(points[np.array(i)]) for i in gx.edges]
-    except KeyError:
-        return get_wnx(gx, points.values)
-    return gp.GeoSeries(edges).rename('geometry').set_crs(CRS)
-
-def get_paths(mx, links, weight='weight', points=HGRID):
-    r = []
-    for link in links:
-        try:
-            r.append(nx.shortest_path(mx, *(link), weight=weight))
-        except nx.exception.NodeNotFound:
-            r.append([])
-    return [LineString(points.loc[j, 'geometry'].values) for j in r]
-
 print(dt.datetime.now() - START)
 print('Get cluster Delaunay network')
 DELAUNAY = Delaunay.from_dataframe(NODES)
 
-DX = DELAUNAY.to_networkx().to_directed()
-EDGES = gp.GeoDataFrame(get_wnx(DX, NODES['geometry']))
+DX = Graph.from_weights(DELAUNAY, NODES).to_directed()
+EDGES = DX.to_frame(CRS, 'distance')
 
 DS4 = NODES.set_index('cluster')['em class']
-EDGES[['source', 'target']] = np.asarray(DX.edges)
-EDGES[['em source', 'em target']] = DS4.values[np.asarray(DX.edges)]
-EDGES['distance'] = EDGES.length
+EDGES[['em source', 'em target']] = DS4.values[EDGES[['source', 'target']].values]
 
 EDGES = gp.GeoDataFrame(EDGES).set_crs(CRS)
 EDGES.to_crs(CRS).to_file(OUTPATH, driver='GPKG', layer='edges')
@@ -189,10 +187,8 @@ EDGES.to_crs(CRS).to_file(OUTPATH, driver='GPKG', layer='edges')
 print(dt.datetime.now() - START)
 print('Get full Delaunay network')
 DELAUNAY = Delaunay.from_dataframe((HGRID))
-DX = DELAUNAY.to_networkx()
-DF2 = nx.to_pandas_edgelist(DX)[['source', 'target']]
-ALLPATHS = gp.GeoDataFrame(get_wnx(DX, HGRID['geometry']))
-ALLPATHS = ALLPATHS.join(DF2)
+DX = Graph.from_weights(DELAUNAY, HGRID)
+ALLPATHS = DX.to_frame(CRS, 'distance')
 ALLPATHS['source'] = HGRID['em class'].values[ALLPATHS['source']]
 ALLPATHS['target'] = HGRID['em class'].values[ALLPATHS['target']]
 ALLPATHS.to_crs(CRS).to_file(OUTPATH, driver='GPKG', layer='D1')
@@ -201,31 +197,25 @@ print(dt.datetime.now() - START)
 print('Clip Delaunay network')
 IDX1 = ALLPATHS.crosses(EXTERIOR)
 ALLPATHS = ALLPATHS.loc[~IDX1]
-ALLPATHS['distance'] = ALLPATHS.length
 ALLPATHS.to_crs(CRS).to_file(OUTPATH, driver='GPKG', layer='D2')
 
 print(dt.datetime.now() - START)
 print('Get shortest-path cluster network')
 FIELDS = ['source', 'target', 'em source', 'em target']
-MX = nx.from_pandas_edgelist(ALLPATHS, edge_attr='distance')
-PX = get_paths(MX, EDGES[['em source', 'em target']].values, 'distance')
+MX = PathCache.from_frame(ALLPATHS, 'distance')
+PX, DISTANCE = MX.get_lines(EDGES[['em source', 'em target']].values, HGRID['geometry'], CRS)
 DEDGES = gp.GeoDataFrame(data=EDGES, columns=FIELDS, geometry=PX).set_crs(CRS)
-DEDGES['distance'] = DEDGES.length
+DEDGES['distance'] = DISTANCE
 DEDGES.to_crs(CRS).to_file(OUTPATH, driver='GPKG', layer='droutes')
 
-def get_path_list(mx, links, weight='weight'):
-    return [nx.shortest_path(mx, *(i), weight=weight) for i in links]
-
 IDX7 = DEDGES.set_index(['source', 'target']).index
-LX = nx.MultiDiGraph([(*IDX7[i], {'leg': k, 'id': i})
-               for i, j in enumerate(
-                       get_path_list(MX, EDGES[['em source', 'em target']].values, 'distance'))
-               for k in pairwise(j)])
+DF4 = pd.DataFrame([(*IDX7[i], k, i)
+                    for i, j in enumerate(MX.get_paths(EDGES[['em source', 'em target']].values))
+                    for k in pairwise(j)], columns=['source', 'target', 'leg', 'id'])
 
 print(dt.datetime.now() - START)
 print('Create network legs')
 
-DF4 = nx.to_pandas_edgelist(LX)
 GB1 = DF4[['leg', 'id']].groupby('leg').count().rename(columns={'id': 'count'})
 DF4 = DF4.join(GB1, on='leg')
 DF4[['em source', 'em target']] = DF4['leg'].apply(pd.Series)
@@ -235,9 +225,10 @@ DF4['direction'] = 'U'
 IDX8 = DF4['source'] > DF4['target']
 DF4.loc[IDX8, 'direction'] = 'D'
 
-LEGS = gp.GeoDataFrame(index=DF4.index, geometry=get_paths(MX, DF4.index, 'distance'), data=DF4)
+PX, DISTANCE = MX.get_lines(DF4.index, HGRID['geometry'], CRS)
+LEGS = gp.GeoDataFrame(index=DF4.index, geometry=PX.values, data=DF4)
 LEGS = LEGS.reset_index(drop=True).set_crs(CRS)
-LEGS['distance'] = LEGS.length
+LEGS['distance'] = DISTANCE
 LEGS.to_crs(CRS).to_file(OUTPATH, driver='GPKG', layer='dd2')
 
 FIELDS = ['source', 'target', 'em source', 'em target', 'distance']
@@ -255,22 +246,31 @@ FX = nx.from_pandas_edgelist(DF6, edge_attr=['capacity'], create_using=nx.DiGrap
 print(dt.datetime.now() - START)
 print('Calculate network flow')
 
-DF6['pfp'] = 0.0
-
 DF6 = DF6.set_index(['source', 'target'])
 LEGS = LEGS.set_index(['source', 'target'])
 
+if CHECK:
+    print(f'Check {DF6.shape[0]} flows with {", ".join(hf.BACKENDS)}')
+    hf.check_flows(FX, DF6.index, JOBS)
+
+print(f'Solve {DF6.shape[0]} flows with {BACKEND} and {JOBS} processes')
+PFP, FLOWS = hf.get_flows(FX, DF6.index, JOBS, BACKEND)
+DF6['pfp'] = PFP.astype(float)
+
 FIELDS = ['em source', 'em target', 'count', 'direction', 'distance']
-DF7 = pd.DataFrame(data=LEGS[FIELDS], index=LEGS.index, columns=FIELDS+list(range(DF6.shape[0])), )
-DF7 = DF7.fillna(0).astype({i: np.integer for i in list(range(DF6.shape[0]))})
+IDX9 = pd.MultiIndex.from_tuples(FX.edges).get_indexer(LEGS.index)
+LEGFLOWS = hf.get_legflows(FLOWS, IDX9)
+DF7 = LEGS[FIELDS].copy()
 
-for i, k in enumerate(DF6.index):
-    R = nx.flow.preflow_push(FX, *k)
-    #R = nx.flow.edmonds_karp(FX, *k)
-    DF6.loc[k, 'pfp'] = R.graph['flow_value']
-    ds = nx.to_pandas_edgelist(R).set_index(['source', 'target'])['flow']
-    ds[ds < 0] = 0
-    DF7.loc[ds.index, i] = ds
+def get_wide(df, flows):
+    """Return df with a flow column per commodity inserted before 'sum' if WIDE
+    """
+    if not WIDE:
+        return df
+    i = df.columns.get_loc('sum')
+    columns = [str(j) for j in range(flows.shape[1])]
+    data = pd.DataFrame(flows.toarray(), index=df.index, columns=columns)
+    return pd.concat([df.iloc[:, :i], data, df.iloc[:, i:]], axis=1)
 
 print(dt.datetime.now() - START)
 print('Create network segments')
@@ -278,26 +278,24 @@ print('Create network segments')
 DF6 = DF6.reset_index()
 DF7 = DF7.reset_index()
 
-DF7['sum'] = DF7[list(range(DF6.shape[0]))].sum('columns')
+DF7['sum'] = np.asarray(LEGFLOWS.sum(axis=1)).ravel()
 
 GF8 = gp.GeoDataFrame(data=DF6, geometry=DEDGES['geometry'])
 GF8 = GF8.set_crs(CRS)
 GF8.to_crs(CRS).to_file(OUTPATH, driver='GPKG', layer='segments')
 
 LEGS = LEGS.reset_index()
-GF9 = gp.GeoDataFrame(data=DF7, geometry=LEGS['geometry'])
+GF9 = gp.GeoDataFrame(data=get_wide(DF7, LEGFLOWS), geometry=LEGS['geometry'])
 GF9 = GF9.set_crs(CRS)
-GF9.columns = [str(i) for i in GF9.columns]
 GF9.to_crs(CRS).to_file(OUTPATH, driver='GPKG', layer='legs')
 
 print(dt.datetime.now() - START)
 print('Calculate network route')
 
-GF10 = gp.GeoDataFrame(data=DF7, geometry=LEGS['geometry'])
+GF10 = gp.GeoDataFrame(data=get_wide(DF7, LEGFLOWS), geometry=LEGS['geometry'])
 GF10 = GF10.set_crs(CRS)
 GF10[['em source', 'em target']] = np.array(
     LEGS[['em source', 'em target']].apply(sorted, axis=1).to_list())
-GF10.columns = [str(i) for i in GF10.columns]
 #SCALE = 2 * (DF6['p*p'] * DF6['p*p']).sum() / (DF6['distance'] * DF6['distance']).sum()
 SCALE = 2 * (DF6['p*p']).sum() / (DF6['distance']).sum()
 GF10['scale'] = GF10['sum'] / SCALE
@@ -306,16 +304,16 @@ GF10.to_crs(CRS).to_file(OUTPATH, driver='GPKG', layer='routes')
 print(dt.datetime.now() - START)
 print('Calculate network sum')
 
-M = GF10.shape[1]
-FIELDS = GF10.columns.take(list(range(7, M))).insert(0, 'em source').insert(1, 'em target')
-DF8 = GF10[FIELDS].groupby(['em source', 'em target']).sum(numeric_only=True)
+FIELDS = ['em source', 'em target']
+IDX10 = GF10.groupby(FIELDS).ngroup().values
+DF8 = GF10[FIELDS + ['sum', 'scale']].groupby(FIELDS).sum()
+DF8 = get_wide(DF8, hf.get_groupflows(LEGFLOWS, IDX10))
 
 LEGS = LEGS.set_index(['em source', 'em target'])
-GF11 = gp.GeoDataFrame(DF8.join(LEGS[['source', 'target', 'count', 'geometry']]))
+GF11 = gp.GeoDataFrame(DF8.join(LEGS[['source', 'target', 'count', 'distance', 'geometry']]))
 LEGS = LEGS.reset_index()
 GF11 = GF11.reset_index()
 GF11['direction'] = 'B'
-GF11['distance'] = GF11.length
 GF11 = GF11[GF10.columns]
 
 GF11['scale'] = GF11['sum'] / SCALE
@@ -1,21 +1,53 @@
 #!/usr/bin/env python3
 
 import os
+from glob import glob
 import datetime as dt
+import argparse
 
+import numpy as np
 import pandas as pd
 import geopandas as gp
-from shapely.geometry import Polygon
+from shapely.geometry import Point, Polygon
 from scipy.spatial import cKDTree
 
-from fiona.errors import DriverError
-
-from herbert.base import archive, append_gf
+from herbert.base import archive
 import herbert.geometry as hg
 import herbert.people as hp
+from herbert.store import GeoPKGBuffer, read_gf, read_region
+from herbert.raster import get_rasterpath, write_raster
 
 pd.set_option('display.max_columns', None)
 
+PYRAMID = False
+MEMORY = None
+METHOD = 'knn'
+KERNEL = 'idw'
+RASTER = False
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='create East Midlands population heatmaps and gridmap')
+    parser.add_argument('-p', dest='pyramid', action='store_true',
+                        help='aggregate 2048m heatmap from 128m heatmap')
+    parser.add_argument('-m', dest='memory', type=int,
+                        help='heatmap query memory budget MB', default=None)
+    parser.add_argument('--method', dest='method', type=str, choices=['knn', 'fft'],
+                        help='heatmap backend', default='knn')
+    parser.add_argument('--kernel', dest='kernel', type=str,
+                        choices=['idw', 'gaussian', 'uniform'],
+                        help='fft heatmap kernel', default='idw')
+    parser.add_argument('-r', dest='raster', action='store_true',
+                        help='write gridmap and heatmaps as GeoTIFF rasters')
+
+    args = parser.parse_args()
+    RASTER = args.raster
+    METHOD = args.method
+    KERNEL = args.kernel
+    PYRAMID = args.pyramid
+    if args.memory:
+        MEMORY = args.memory * 2**20
+
 START = dt.datetime.now()
 
 print('Load_boundaries')
@@ -37,23 +69,35 @@ CENTRES = gp.GeoDataFrame(data=BOUNDARIES[KEYS],
 BOXES = gp.GeoDataFrame(data=BOUNDARIES[KEYS],
                         geometry=BOUNDARIES.envelope).set_crs(CRS)
 
-print(dt.datetime.now() - START)
-print(f'Read geography {LAYER}')
-
 FILEPATH = 'grid.gpkg'
 LAYER = 'OA'
-try:
-    GEOGRAPHY
-except NameError:
-    GEOGRAPHY = gp.read_file(FILEPATH, layer=LAYER).to_crs(CRS)
+if not PYRAMID:
+    print(dt.datetime.now() - START)
+    print(f'Read geography {LAYER}')
+    try:
+        GEOGRAPHY
+    except NameError:
+        GEOGRAPHY = read_gf(FILEPATH, LAYER, crs=CRS)
+
+    print(dt.datetime.now() - START)
+    print(f'Read geography {LAYER} index')
+    try:
+        TREE
+    except NameError:
+        TREE = hp.read_tree(FILEPATH, LAYER, GEOGRAPHY)
 
 OUTPATH = 'east-midlands.gpkg'
 archive(OUTPATH)
-CENTRES.to_crs(CRS).to_file(OUTPATH, driver='GPKG', layer='centres')
-BOXES.to_crs(CRS).to_file(OUTPATH, driver='GPKG', layer='boundaries')
+WRITER = GeoPKGBuffer(OUTPATH, CRS, sidecar=True)
+if RASTER:
+    for filepath in glob(get_rasterpath(OUTPATH, '*')):
+        archive(filepath)
+WRITER.write(CENTRES, 'centres')
+WRITER.write(BOXES, 'boundaries')
 
 R = 128
 D = 2048
+HOW = {'distance': 'mean', 'weight': 'mean', 'weight2': 'mean', 'class': 'max', 'p': 'sum'}
 
 TOWNS = gp.GeoDataFrame(columns=['name', 'distance', 'p', 'p2',
                                  'area', 'population', 'geometry'], dtype=int)
@@ -62,7 +106,7 @@ EMCLASSES = [1, 10, 15, 21, 34, 45, 48]
 GF = BOUNDARIES[BOUNDARIES['class'].isin(EMCLASSES)]
 
 FIELDS = ['area', 'population', 'sarea', 'geometry']
-GF[FIELDS].dissolve(aggfunc='sum').to_crs(CRS).to_file(OUTPATH, driver='GPKG', layer='boundary')
+WRITER.write(GF[FIELDS].dissolve(aggfunc='sum'), 'boundary')
 
 for i, boundary in GF.iterrows():
     #if i != 34:
@@ -71,58 +115,87 @@ for i, boundary in GF.iterrows():
     centre = hg.get_point(CENTRES.loc[i])
 
     N = 32
-    n, m = hg.get_extent(boundary, R)
+    extent = hg.get_extent(boundary, R)
+    n, m = extent
     print(f'Create {i + 1} of {BOUNDARIES.shape[0]}: {n} x {m} grid {R}m')
-    mesh = hg.get_meshframe(boundary, centre, R)
+    mesh = hg.RegularGrid.from_geometry(boundary['geometry'], extent, centre, R)
+    print(dt.datetime.now() - START)
+    print(f'Read region geography {LAYER}')
+    # keep float64 density as it scales the gridmap population
+    region = read_region(FILEPATH, LAYER, boundary['geometry'], 8192.0, crs=CRS, schema=None)
     print(dt.datetime.now() - START)
     print(f'Create gridmap {N} connections')
-    grid = mesh.sjoin_nearest(GEOGRAPHY, max_distance=8192.0)
-    grid['p'] = grid['density'] * R * R / 1.0E6
+    d, j = hp.get_tree(region).query(mesh.points, distance_upper_bound=8192.0)
+    idx = np.isfinite(d)
+    grid = mesh.get_subgrid(idx)
+    grid['p'] = region['density'].values[j[idx]] * R * R / 1.0E6
     grid['p'] = grid['p'] * boundary['population'] / grid['p'].sum()
-    heatgrid = hp.get_heatframe(mesh, grid, 'p', N)
-    heatgrid = heatgrid.rename(columns={'weight': 'p', 'weight2': 'p2'})
-    kscale = boundary['population'] / heatgrid['p'].sum()
+    hp.get_heatgrid(mesh, grid, 'p', N, memory=MEMORY, method=METHOD, kernel=KERNEL)
+    mesh['class'] = i
+    kscale = boundary['population'] / mesh['weight'].sum()
     print(f'Ratio v to population {kscale}')
-    heatgrid['p'] = heatgrid['p'] * kscale
-    heatgrid['class'] = i
+    mesh['p'] = mesh['weight'] * kscale
+    BANDS = {'p': 'p', 'p2': 'weight2', 'distance': 'distance'}
 
     print(dt.datetime.now() - START)
     print('Write gridmap')
     #OUTPATH = f'{FILEDIR}/{FILESTUB}-{str(i+1).zfill(2)}.gpkg'
     #archive(OUTPATH)
-    append_gf(heatgrid.to_crs(CRS), OUTPATH, f'gridmap {R}m', CRS)
-
-    heatmap = hp.get_heatmap(mesh, grid, i, R, N, 'p')
-    heatmap = heatmap.rename(columns={'weight2': 'p2'})
-    heatmap['p'] = heatmap['weight'] * kscale
+    if RASTER:
+        write_raster(mesh, get_rasterpath(OUTPATH, f'gridmap {R}m', i), BANDS, CRS)
+    else:
+        heatgrid = mesh.to_frame(['distance', 'p', 'weight2', 'class'], crs=CRS)
+        heatgrid = heatgrid.rename(columns={'weight2': 'p2'})
+        WRITER.write(heatgrid, f'gridmap {R}m')
 
     print(dt.datetime.now() - START)
     print('Write heatmap')
-    append_gf(heatmap.to_crs(CRS), OUTPATH, f'heatmap {R}m', CRS)
+    if RASTER:
+        BANDS['weight'] = 'weight'
+        write_raster(mesh, get_rasterpath(OUTPATH, f'heatmap {R}m', i), BANDS, CRS)
+    else:
+        FIELDS = ['distance', 'weight', 'weight2', 'class', 'p']
+        heatmap = mesh.to_frame(FIELDS, R, 0.2, CRS)
+        heatmap = heatmap.rename(columns={'weight2': 'p2'})
+        WRITER.write(heatmap, f'heatmap {R}m')
 
     N = 512
-    n, m = hg.get_extent(boundary, D)
-    print(f'Create {i + 1} of {BOUNDARIES.shape[0]}: {n} x {m} grid {D}m')
-    mesh = hg.get_meshframe(boundary, centre, D)
-    print(dt.datetime.now() - START)
-    print(f'Create heatmap {N} connections')
-    heatmap = hp.get_heatmap(mesh, GEOGRAPHY, i, D)
-    heatmap = heatmap.rename(columns={'weight': 'p', 'weight2': 'p2'})
+    if PYRAMID:
+        print(f'Aggregate {i + 1} of {BOUNDARIES.shape[0]}: heatmap {D}m')
+        coarse = hg.get_pyramid(mesh, [D], HOW)[D]
+        P = 'p'
+    else:
+        extent = hg.get_extent(boundary, D)
+        n, m = extent
+        print(f'Create {i + 1} of {BOUNDARIES.shape[0]}: {n} x {m} grid {D}m')
+        coarse = hg.RegularGrid.from_geometry(boundary['geometry'], extent, centre, D)
+        print(dt.datetime.now() - START)
+        print(f'Create heatmap {N} connections')
+        hp.get_heatgrid(coarse, GEOGRAPHY, 'population', N, TREE, MEMORY, METHOD, KERNEL)
+        coarse['class'] = i
+        P = 'weight'
+    BANDS = {'distance': 'distance', 'p': P, 'p2': 'weight2'}
 
     print(dt.datetime.now() - START)
     print('Write heatmap')
-    append_gf(heatmap.to_crs(CRS), OUTPATH, f'heatmap {D}m', CRS)
-
-    idx1 = gp.clip(GEOGRAPHY['geometry'], boundary['geometry']).index
+    if RASTER:
+        write_raster(coarse, get_rasterpath(OUTPATH, f'heatmap {D}m', i), BANDS, CRS)
+    else:
+        FIELDS = ['distance', P, 'weight2', 'class']
+        KEYS = {P: 'p', 'weight2': 'p2'}
+        heatmap = coarse.to_frame(FIELDS, D, 0.2, CRS).rename(columns=KEYS)
+        WRITER.write(heatmap, f'heatmap {D}m')
+
+    idx1 = hg.get_within(region, GF.loc[[i]], predicate='intersects') > -1
     FIELDS = ['area', 'population']
-    TOWNS.loc[i, FIELDS] = GEOGRAPHY.loc[idx1, FIELDS].sum()
-    idx2 = heatmap['p'].idxmax()
-    FIELDS = ['distance', 'p', 'p2']
-    TOWNS.loc[i, FIELDS] = heatmap.loc[idx2, FIELDS]
-    TOWNS.loc[i, 'geometry'] = mesh.loc[idx2, 'geometry']
+    TOWNS.loc[i, FIELDS] = region.loc[idx1, FIELDS].sum()
+    idx2 = np.argmax(coarse[P])
+    FIELDS = list(BANDS)
+    TOWNS.loc[i, FIELDS] = [coarse[v][idx2] for v in BANDS.values()]
+    TOWNS.loc[i, 'geometry'] = Point(coarse.points[idx2])
     TOWNS['name'] = f'T{str(i).zfill(3)}'
 
 TOWNS['name'] = [f'C{str(i).zfill(3)}' for i in range(1, TOWNS.shape[0] + 1)]
 TOWNS = TOWNS.set_crs(CRS)
-TOWNS.to_crs(CRS).to_file(OUTPATH, driver='GPKG', layer='cities')
-
+WRITER.write(TOWNS, 'cities')
+WRITER.close()
@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
 
+import argparse
+
 import pandas as pd
 import geopandas as gp
 
@@ -7,10 +9,24 @@ from shapely.validation import make_valid
 from shapely.geometry import Polygon
 
 from herbert.base import archive
-from herbert.people import get_density
+from herbert.geometry import dissolve
+from herbert.people import get_density, get_tree, get_treepath, write_tree
+from herbert.people import Hierarchy, get_hierarchypath, write_hierarchy
+from herbert.store import write_gf
 
 pd.set_option('display.max_columns', None)
 
+JOBS = 1
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='create OA, LSOA and MSOA geography and population grid')
+    parser.add_argument('-j', dest='jobs', type=int,
+                        help='number of parallel dissolve processes', default=1)
+
+    args = parser.parse_args()
+    JOBS = args.jobs
+
 # EPSG:4326 WG 84
 # EPSG:32630
 # EPSG:27700 OS GB36
@@ -114,7 +130,15 @@ GRID = gp.GeoDataFrame(POPULATION.join(CENTROID.rename('geometry'), on='OA'))
 print('Write grid')
 GRIDPATH = 'grid.gpkg'
 archive(GRIDPATH)
-GRID.to_crs(CRS).to_file(GRIDPATH, driver='GPKG', layer='OA')
+write_gf(GRID, GRIDPATH, 'OA', CRS, sidecar=True)
+print('Write grid index')
+write_tree(get_tree(GRID), get_treepath(GRIDPATH, 'OA'))
+
+print('Write grid hierarchy')
+HIERARCHY = Hierarchy.from_frame(GRID)
+write_hierarchy(HIERARCHY, get_hierarchypath(GRIDPATH))
+DF4 = HIERARCHY.get_frame('LSOA', GRID).set_index('LSOA')
+DF5 = HIERARCHY.get_frame('MSOA', GRID).set_index('MSOA')
 del GRID
 
 print('Write Geography')
@@ -122,48 +146,43 @@ FILEPATH = 'geography.gpkg'
 archive(FILEPATH)
 
 print('Write OA geography')
-GEOGRAPHY.to_crs(CRS).to_file(FILEPATH, driver='GPKG', layer='OA')
+write_gf(GEOGRAPHY, FILEPATH, 'OA', CRS, sidecar=True)
 
 print('Aggregate LSOA geography')
-FIELDS = ['LSOA', 'area', 'population', 'geometry']
-LSOA = GEOGRAPHY[FIELDS].dissolve(by='LSOA', aggfunc='sum')
-LSOA['density'] = get_density(LSOA)
-KEYS = ['LSOA', 'MSOA', 'Country']
-DS4 = POPULATION[KEYS].drop_duplicates().set_index('LSOA')
-LSOA = LSOA.join(DS4).reset_index()
+FIELDS = ['LSOA', 'geometry']
+LSOA = dissolve(GEOGRAPHY[FIELDS], 'LSOA', processes=JOBS)
+LSOA = LSOA.join(DF4).reset_index()
 FIELDS = ['LSOA', 'MSOA', 'Country', 'area', 'population', 'density', 'geometry']
 LSOA = LSOA[FIELDS]
 del GEOGRAPHY
 
 print('Write LSOA geography')
-LSOA.to_crs(CRS).to_file(FILEPATH, driver='GPKG', layer='LSOA')
+write_gf(LSOA, FILEPATH, 'LSOA', CRS, sidecar=True)
 
 CENTROID = LSOA.centroid.rename('geometry')
 GRID = gp.GeoDataFrame(LSOA.drop('geometry', axis=1), geometry=CENTROID)
-GRID.to_crs(CRS).to_file(GRIDPATH, driver='GPKG', layer='LSOA')
+write_gf(GRID, GRIDPATH, 'LSOA', CRS, sidecar=True)
 del GRID
 
 print('Aggregate MSOA geography')
-MSOA = LSOA.dissolve(by='MSOA', aggfunc='sum')
-MSOA['density'] = get_density(MSOA)
-KEYS = ['MSOA', 'Country']
-DS5 = POPULATION[KEYS].drop_duplicates().set_index('MSOA')
-MSOA = MSOA.join(DS5).reset_index()
+FIELDS = ['MSOA', 'geometry']
+MSOA = dissolve(LSOA[FIELDS], 'MSOA', processes=JOBS)
+MSOA = MSOA.join(DF5).reset_index()
 FIELDS = ['MSOA', 'Country', 'area', 'population', 'density', 'geometry']
 MSOA = MSOA[FIELDS]
 del LSOA
 
 print('Write MSOA geography')
-MSOA.to_crs(CRS).to_file(FILEPATH, driver='GPKG', layer='MSOA')
+write_gf(MSOA, FILEPATH, 'MSOA', CRS, sidecar=True)
 
 CENTROID = MSOA.centroid.rename('geometry')
 GRID = gp.GeoDataFrame(MSOA.drop('geometry', axis=1), geometry=CENTROID)
-GRID.to_crs(CRS).to_file(GRIDPATH, driver='GPKG', layer='MSOA')
+write_gf(GRID, GRIDPATH, 'MSOA', CRS, sidecar=True)
 del GRID
 
 print('Write GB outline')
 OUTER = MSOA['geometry'].apply(make_valid)
-OUTER = OUTER.reset_index().dissolve()
+OUTER = dissolve(OUTER.reset_index())
 OUTER = OUTER.explode(ignore_index=True).drop(columns='index')
 OUTER['geometry'] = OUTER.exterior
 OUTER['geometry'] = OUTER['geometry'].apply(Polygon)
@@ -175,7 +194,7 @@ BRITAIN = OUTER[OUTER['area'] > 1.0E8].copy()
 BRITAIN['geometry'] = BRITAIN.simplify(10, preserve_topology=False)
 GS1 = BRITAIN['geometry'].simplify(100)
 BRITAIN = BRITAIN[GS1.distance(GS1[0]) < 2.0E3]
-BRITAIN = BRITAIN.dissolve()
+BRITAIN = dissolve(BRITAIN)
 BRITAIN.to_file('britain.gpkg', driver='GPKG', layer='outer')
 
 GS2 = OUTER.centroid
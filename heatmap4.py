@@ -1,19 +1,52 @@
 #!/usr/bin/env python3
 
 import datetime as dt
+import argparse
 
+import numpy as np
 import pandas as pd
 import geopandas as gp
+from shapely.geometry import Point
 
 import scipy as sp
 
-from herbert.base import archive, append_gf
+from herbert.base import archive, pool_map
 import herbert.geometry as hg
 import herbert.people as hp
+from herbert.store import GeoPKGBuffer, read_gf
 
 
 pd.set_option('display.max_columns', None)
 
+JOBS = 1
+PYRAMID = False
+MEMORY = None
+METHOD = 'knn'
+KERNEL = 'idw'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='create GB population heatmaps for each boundary region')
+    parser.add_argument('-j', dest='jobs', type=int,
+                        help='number of parallel region processes', default=1)
+    parser.add_argument('-p', dest='pyramid', action='store_true',
+                        help='aggregate 8192m heatmap from 2048m heatmap')
+    parser.add_argument('-m', dest='memory', type=int,
+                        help='heatmap query memory budget MB', default=None)
+    parser.add_argument('--method', dest='method', type=str, choices=['knn', 'fft'],
+                        help='heatmap backend', default='knn')
+    parser.add_argument('--kernel', dest='kernel', type=str,
+                        choices=['idw', 'gaussian', 'uniform'],
+                        help='fft heatmap kernel', default='idw')
+
+    args = parser.parse_args()
+    METHOD = args.method
+    KERNEL = args.kernel
+    JOBS = args.jobs
+    PYRAMID = args.pyramid
+    if args.memory:
+        MEMORY = args.memory * 2**20
+
 CRS = hg.readupdate_crs('EPSG:32630')
 
 START = dt.datetime.now()
@@ -42,68 +75,104 @@ FILEPATH = 'grid.gpkg'
 try:
     GEOGRAPHY
 except NameError:
-    GEOGRAPHY = gp.read_file(FILEPATH, layer=LAYER).to_crs(CRS)
+    GEOGRAPHY = read_gf(FILEPATH, LAYER, crs=CRS)
+
+print(dt.datetime.now() - START)
+print(f'Read geography {LAYER} index')
+try:
+    TREE
+except NameError:
+    TREE = hp.read_tree(FILEPATH, LAYER, GEOGRAPHY)
 
 OUTPATH = 'heatmap.gpkg'
 archive(OUTPATH)
-CENTRES.to_crs(CRS).to_file(OUTPATH, driver='GPKG', layer='centres')
-BOXES.to_crs(CRS).to_file(OUTPATH, driver='GPKG', layer='boundaries')
+WRITER = GeoPKGBuffer(OUTPATH, CRS)
+WRITER.write(CENTRES, 'centres')
+WRITER.write(BOXES, 'boundaries')
 
 D = 2048
 R = 8192
 N = 512
+HOW = {'distance': 'mean', 'weight': 'mean', 'weight2': 'mean', 'class': 'max'}
 
 #FILESTUB = os.path.basename(OUTPATH).split('.')[0]
 #FILEDIR = os.path.dirname(OUTPATH)
 
 TOWNS = gp.GeoDataFrame(columns=['name', 'class', 'area', 'population', 'geometry'], dtype=int)
 
-for i, boundary in BOUNDARIES.iterrows():
+def get_region(i):
+    """
+    Return 8192m and 2048m heatmaps, population sums and town location
+    for region i in BOUNDARIES
+
+    :param i: BOUNDARIES index
+    """
+    boundary = BOUNDARIES.loc[i]
     print(dt.datetime.now() - START)
     #OUTPATH = f'{FILEDIR}/{FILESTUB}-{str(i+1).zfill(2)}.gpkg'
     #archive(OUTPATH)
 
     centre = hg.get_point(CENTRES.loc[i])
 
-    m, n = hg.get_extent(boundary, R)
-    print(f'Create {i + 1} of {BOUNDARIES.shape[0]}: {m} x {n} grid {R}m')
-    print(f'Create heatmap {N} connections')
-    mesh = hg.get_meshframe(boundary, centre, R)
-    heatmap = hp.get_heatmap(mesh, GEOGRAPHY, i, R)
-    heatmap = heatmap.rename(columns={'weight': 'p', 'weight2': 'p2'})
-    print(dt.datetime.now() - START)
-    print('Write heatmap')
-    append_gf(heatmap, OUTPATH, f'heatmap {R}m', CRS)
-
-    m, n = hg.get_extent(boundary, D)
+    FIELDS = ['distance', 'weight', 'weight2', 'class']
+    KEYS = {'weight': 'p', 'weight2': 'p2'}
+    extent = hg.get_extent(boundary, D)
+    m, n = extent
     print(f'Create {i + 1} of {BOUNDARIES.shape[0]}: {m} x {n} grid {D}m')
     print(f'Create heatmap {N} connections')
-    mesh = hg.get_meshframe(boundary, centre, D)
-    heatmap = hp.get_heatmap(mesh, GEOGRAPHY, i, D)
-    heatmap = heatmap.rename(columns={'weight': 'p', 'weight2': 'p2'})
+    mesh = hg.RegularGrid.from_geometry(boundary['geometry'], extent, centre, D)
+    hp.get_heatgrid(mesh, GEOGRAPHY, 'population', N, TREE, MEMORY, METHOD, KERNEL)
+    mesh['class'] = i
+    heatmap2 = mesh.to_frame(FIELDS, D, 0.2, CRS).rename(columns=KEYS)
+
+    if PYRAMID:
+        print(f'Aggregate {i + 1} of {BOUNDARIES.shape[0]}: heatmap {R}m')
+        coarse = hg.get_pyramid(mesh, [R], HOW)[R]
+    else:
+        extent = hg.get_extent(boundary, R)
+        m, n = extent
+        print(f'Create {i + 1} of {BOUNDARIES.shape[0]}: {m} x {n} grid {R}m')
+        print(f'Create heatmap {N} connections')
+        coarse = hg.RegularGrid.from_geometry(boundary['geometry'], extent, centre, R)
+        hp.get_heatgrid(coarse, GEOGRAPHY, 'population', N, TREE, MEMORY, METHOD, KERNEL)
+        coarse['class'] = i
+    heatmap1 = coarse.to_frame(FIELDS, R, 0.2, CRS).rename(columns=KEYS)
+
+    idx1 = INSIDE[INSIDE[:, 1] == BOUNDARIES.index.get_loc(i), 0]
+    FIELDS = ['area', 'population']
+    population = GEOGRAPHY[FIELDS].iloc[idx1].sum()
+    idx2 = np.argmax(mesh['weight2'])
+    return heatmap1, heatmap2, population, Point(mesh.points[idx2])
+
+print(dt.datetime.now() - START)
+print('Find geography boundaries')
+INSIDE = hg.get_adjacency(GEOGRAPHY, BOUNDARIES, 'intersects')
+
+print(f'Create {BOUNDARIES.shape[0]} regions with {JOBS} processes')
+REGIONS = pool_map(get_region, BOUNDARIES.index, JOBS)
+for i, (heatmap1, heatmap2, population, town) in zip(BOUNDARIES.index, REGIONS):
     print(dt.datetime.now() - START)
-    print('Write heatmap')
-    append_gf(heatmap, OUTPATH, f'heatmap {D}m', CRS)
+    print(f'Write heatmap {i + 1} of {BOUNDARIES.shape[0]}')
+    WRITER.write(heatmap1, f'heatmap {R}m')
+    WRITER.write(heatmap2, f'heatmap {D}m')
 
     TOWNS.loc[i, 'class'] = i
-    idx1 = gp.clip(GEOGRAPHY['geometry'], boundary['geometry']).index
     FIELDS = ['area', 'population']
-    TOWNS.loc[i, FIELDS] = GEOGRAPHY.loc[idx1, FIELDS].sum()
+    TOWNS.loc[i, FIELDS] = population
     TOWNS.loc[i, 'name'] = f'C{str(i).zfill(2)}'
-    heatframe = hp.get_heatframe(mesh, GEOGRAPHY, 'population', N)
-    idx2 = heatframe['weight2'].idxmax()
-    TOWNS.loc[i, 'geometry'] = heatframe.loc[idx2, 'geometry']
+    TOWNS.loc[i, 'geometry'] = town
 
 #OUTPATH = 'output/heatmap.gpkg'
 TOWNS = TOWNS.set_crs(CRS)
 FIELDS = ['class', 'area', 'population']
 TOWNS[FIELDS] = TOWNS[FIELDS].astype(int)
-TOWNS.to_crs(CRS).to_file(OUTPATH, driver='GPKG', layer='towns')
+WRITER.write(TOWNS, 'towns')
 
 POINTS = hg.get_points(TOWNS)
 TRIANGLES = sp.spatial.Delaunay(POINTS)
 
-LINES = hg.get_lines(TRIANGLES.simplices, TOWNS['name'].values, POINTS, CRS)
-LINES['km'] = LINES.length / 1.0E3
+LINES = hg.get_lines(TRIANGLES.simplices, TOWNS['name'].values, POINTS, CRS, 'm')
+LINES['km'] = LINES.pop('m') / 1.0E3
 
-LINES.reset_index().to_crs(CRS).to_file(OUTPATH, driver='GPKG', layer='delaunay')
+WRITER.write(LINES.reset_index(), 'delaunay')
+WRITER.close()
@@ -1,10 +1,25 @@
 import os
+import sys
+from contextlib import contextmanager
 from itertools import cycle, tee, product
+from multiprocessing import get_context
+from tempfile import NamedTemporaryFile
 import numpy as np
-from fiona.errors import DriverError
 from pandas.api.types import is_numeric_dtype, is_integer_dtype
 from pandas.api.types import is_float_dtype
 
+# compact column dtypes for grid and geography layers, with the decimal
+# places float columns must keep. Only repeating area codes are categorical,
+# as unique OA codes would need a categories array as large as the column
+SCHEMA = {
+    'LSOA': 'category',
+    'MSOA': 'category',
+    'Country': 'category',
+    'population': 'int32',
+    'density': ('float32', 1),
+    'x': 'float32',
+    'y': 'float32',
+}
 
 def archive(filepath):
     """
@@ -23,18 +38,52 @@ def archive(filepath):
     except FileNotFoundError:
         pass
 
-def append_gf(gf, filepath, layer, crs):
+@contextmanager
+def replace_file(filepath):
     """
-    Append layer to GeoPKG filepath
+    Yield binary file object of a unique temporary file in the filepath
+    directory, which replaces filepath when the with block completes. So
+    concurrent writers never leave a partly written file at filepath
 
-    :param filepath:
-    :param gf: GeoDataFrame
-    :param layer: layer name
+    :param filepath: filepath to write
     """
-    try:
-        gf.to_crs(crs).to_file(filepath, driver='GPKG', mode='a', layer=layer)
-    except DriverError:
-        gf.to_crs(crs).to_file(filepath, driver='GPKG', layer=layer)
+    with NamedTemporaryFile('wb', dir=os.path.dirname(filepath) or '.', delete=False) as fout:
+        try:
+            yield fout
+        except BaseException:
+            fout.close()
+            os.remove(fout.name)
+            raise
+    os.replace(fout.name, filepath)
+
+def set_threads(n_threads=1):
+    """
+    Limit numba parallel kernels to n_threads, if numba is loaded, so that
+    pool workers do not each start a thread per core
+
+    :param n_threads: number of threads
+    """
+    numba = sys.modules.get('numba')
+    if numba is not None:
+        numba.set_num_threads(n_threads)
+
+def pool_map(func, iterable, processes=1):
+    """
+    Return iterator of func applied to iterable, in order.
+    Where processes > 1 spread calls over a forked process pool, so workers
+    share module-level read-only data, such as the OA grid, copy-on-write
+    rather than pickling it for each task. Workers run numba kernels on a
+    single thread
+
+    :param func: module-level function of one argument
+    :param iterable: function arguments
+    :param processes: number of worker processes
+    """
+    if processes is None or processes < 2:
+        yield from map(func, iterable)
+        return
+    with get_context('fork').Pool(processes, set_threads) as pool:
+        yield from pool.imap(func, iterable)
 
 def pairwise(i):
     """
@@ -102,33 +151,61 @@ def list_files(filepath):
     return files
 
 
-def reduce_mem_usage(df, drop=False, output=True):
+def get_dtype(this_ds, dtype, decimals=None):
+    """
+    Return data-series cast to dtype where no value changes, or no value
+    changes when rounded to decimals places, otherwise unchanged
+
+    :param this_ds: pandas data-series
+    :param dtype: target dtype
+    :param decimals: decimal places float values must keep
+    """
+    if dtype == 'category':
+        if is_numeric_dtype(this_ds):
+            return this_ds
+        try:
+            return this_ds.astype('category')
+        except TypeError:
+            return this_ds
+    if not is_numeric_dtype(this_ds):
+        return this_ds
+    if np.dtype(dtype).kind in 'iu':
+        if this_ds.isna().any():
+            return this_ds
+        info = np.iinfo(dtype)
+    else:
+        info = np.finfo(dtype)
+    if this_ds.min() < info.min or this_ds.max() > info.max:
+        return this_ds
+    r = this_ds.astype(dtype)
+    u, v = this_ds.to_numpy(dtype=float), r.to_numpy(dtype=float)
+    if decimals is not None:
+        u, v = np.round(u, decimals), np.round(v, decimals)
+    if np.array_equal(u, v, equal_nan=True):
+        return r
+    return this_ds
+
+def reduce_mem_usage(df, drop=False, output=True, schema=None):
     """
     Iterate through all the columns of a DataFrame, convert non-numerical
-    data to 'categorical' and modify the data type to reduce memory usage
+    data to 'categorical' and modify the data type to reduce memory usage.
+    Numeric columns are only downcast where no value changes.
+    Where schema is set only convert its columns to their schema dtype
     https://www.kaggle.com/gemartin/load-data-reduce-memory-usage
 
     :params df: pandas DataFrame
+    :params drop: drop non-numerical columns
+    :params output: print memory usage
+    :params schema: dict of column and dtype, or dtype and decimal places
     """
-    def get_dtype_int(this_ds, c_min, c_max):
-        if c_min > np.iinfo(np.int8).min and c_max < np.iinfo(np.int8).max:
-            return this_ds.astype(np.int8)
-        if c_min > np.iinfo(np.int16).min and c_max < np.iinfo(np.int16).max:
-            return this_ds.astype(np.int16)
-        if c_min > np.iinfo(np.int32).min and c_max < np.iinfo(np.int32).max:
-            return this_ds.astype(np.int32)
-        return this_ds.astype(np.int64)
-
-    def get_dtype_float(this_ds, c_min, c_max):
-        if c_min > np.finfo(np.float16).min and c_max < np.finfo(np.float16).max:
-            return this_ds.astype(np.float16)
-        if c_min > np.finfo(np.float32).min and c_max < np.finfo(np.float32).max:
-            return this_ds.astype(np.float32)
-        return this_ds.astype(np.float64)
     if output:
-        start_mem = df.memory_usage().sum() / 1024**2
+        start_mem = df.memory_usage(deep=True).sum() / 1024**2
         print(f'Memory usage of dataframe is {round(start_mem, 2)} MB')
-    for col in df.columns:
+    if schema is not None:
+        for col in df.columns.intersection(list(schema)):
+            dtype, decimals = schema[col] if isinstance(schema[col], tuple) else (schema[col], None)
+            df[col] = get_dtype(df[col], dtype, decimals)
+    for col in df.columns if schema is None else []:
         if not is_numeric_dtype(df[col]):
             try:
                 df[col] = df[col].astype('category')
@@ -141,13 +218,21 @@ def reduce_mem_usage(df, drop=False, output=True):
                 df = df.drop(columns=[col])
             continue
         if is_integer_dtype(df[col]):
-            df[col] = get_dtype_int(df[col], df[col].min(), df[col].max())
+            for dtype in [np.int8, np.int16, np.int32]:
+                r = get_dtype(df[col], dtype)
+                if r.dtype == dtype:
+                    df[col] = r
+                    break
             continue
         if is_float_dtype(df[col]):
-            df[col] = get_dtype_float(df[col], df[col].min(), df[col].max())
+            for dtype in [np.float16, np.float32]:
+                r = get_dtype(df[col], dtype)
+                if r.dtype == dtype:
+                    df[col] = r
+                    break
             continue
     if output:
-        end_mem = df.memory_usage().sum() / 1024**2
+        end_mem = df.memory_usage(deep=True).sum() / 1024**2
         print(f'Memory usage after optimization is: {round(end_mem,2)} MB')
         print(f'Decreased by {round(100 * (start_mem - end_mem) / start_mem, 1)}')
     return df
@@ -1,10 +1,12 @@
 from itertools import product, cycle
 import numpy as np
 import geopandas as gp
+import shapely
 from shapely.geometry import LineString, Point
-from .base import pairwise, reduce_mem_usage
+from .base import pairwise, pool_map, reduce_mem_usage
 
 CRS = 'EPSG:32630'
+GEOMETRY = None
 def readupdate_crs(crs='EPSG:32630'):
     """
     Return CRS and/or set CRS value
@@ -28,8 +30,10 @@ def get_points(gf):
     Return numpy 2D coordinate array from GeoDataFrame Points geometry
     Also GeoSeries Points geometry with recursive call
 
-    :param gf: GeoPanda dataframe or series
+    :param gf: GeoPanda dataframe or series, or RegularGrid
     """
+    if isinstance(gf, RegularGrid):
+        return gf.points
     try:
         return np.array([gf['geometry'].x.values, gf['geometry'].y.values]).T
     except KeyError:
@@ -88,9 +92,9 @@ def get_centres(gf):
     r = v.reshape(-1, 2).sum(axis=1).reshape(-1, 2) / 2.0
     return gp.points_from_xy(*r.T)
 
-def get_mesharray(xy_array, centre, d):
+def get_meshaxes(xy_array, centre, d):
     """
-    Return 2D xr by yr numpy square-mesh array of points covering GeoDataFrame.
+    Return x and y numpy axis arrays of square-mesh covering GeoDataFrame.
     Centred on the point 'centre' and separated at a distance 'd'
 
     :param xy_array: size of m, n
@@ -101,9 +105,257 @@ def get_mesharray(xy_array, centre, d):
     m, n = xy_array
     x_linear = np.linspace(xoffset, xoffset + m * d, m)
     y_linear = np.linspace(yoffset, yoffset + n * d, n)
-    x_s, y_s = np.meshgrid(x_linear, y_linear, sparse=True)
-    r = list(product(x_s.reshape(-1), y_s.reshape(-1)))
-    return np.array(r).reshape(-1, 2)
+    return x_linear, y_linear
+
+def get_mesharray(xy_array, centre, d):
+    """
+    Return 2D xr by yr numpy square-mesh array of points covering GeoDataFrame.
+    Centred on the point 'centre' and separated at a distance 'd'
+
+    :param xy_array: size of m, n
+    :param centre: GeoDataFrame centre-point
+    :param d: square edge size
+    """
+    x_linear, y_linear = get_meshaxes(xy_array, centre, d)
+    r = np.meshgrid(x_linear, y_linear, indexing='ij')
+    return np.stack(r, axis=-1).reshape(-1, 2)
+
+def get_meshindex(geometry, x_linear, y_linear):
+    """
+    Return x and y axis index arrays of mesh points inside or on the boundary
+    of geometry, ordered by x then y.
+    Rasterise along vertical scanlines through each x, bucketing the polygon
+    edges by the scanlines they cross, so cost scales with the number of
+    crossings and inside points rather than the bounding mesh
+
+    :param geometry: Polygon or MultiPolygon geometry
+    :param x_linear: mesh x axis array
+    :param y_linear: mesh y axis array
+    """
+    parts = shapely.get_parts(np.asarray(geometry, dtype=object).reshape(-1))
+    rings = shapely.get_rings(parts)
+    coords, ring = shapely.get_coordinates(rings, return_index=True)
+    idx = ring[:-1] == ring[1:]
+    p1, p2 = coords[:-1][idx], coords[1:][idx]
+    lower = np.searchsorted(x_linear, np.minimum(p1[:, 0], p2[:, 0]))
+    upper = np.searchsorted(x_linear, np.maximum(p1[:, 0], p2[:, 0]))
+    count = upper - lower
+    edge = np.repeat(np.arange(count.size), count)
+    j = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count) + lower[edge]
+    p1, p2 = p1[edge], p2[edge]
+    y = p1[:, 1] + (x_linear[j] - p1[:, 0]) * (p2[:, 1] - p1[:, 1]) / (p2[:, 0] - p1[:, 0])
+    order = np.lexsort((y, j))
+    j, y = j[order].reshape(-1, 2)[:, 0], y[order].reshape(-1, 2)
+    lower = np.searchsorted(y_linear, y[:, 0], side='left')
+    upper = np.searchsorted(y_linear, y[:, 1], side='right')
+    count = np.maximum(upper - lower, 0)
+    span = np.repeat(np.arange(count.size), count)
+    k = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count) + lower[span]
+    return j[span], k
+
+def get_meshinside(geometry, xy_array, centre, d):
+    """
+    Return 2D numpy array of square-mesh points inside geometry.
+    Centred on the point 'centre' and separated at a distance 'd'
+
+    :param geometry: Polygon or MultiPolygon geometry
+    :param xy_array: size of m, n
+    :param centre: GeoDataFrame centre-point
+    :param d: square edge size
+    """
+    x_linear, y_linear = get_meshaxes(xy_array, centre, d)
+    j, k = get_meshindex(geometry, x_linear, y_linear)
+    return np.stack([x_linear[j], y_linear[k]], axis=-1)
+
+class RegularGrid:
+    """
+    Regular square-mesh held as x and y axes, a validity mask and per-cell
+    attribute arrays in valid-cell order, x then y. Point and cell lookups are
+    O(1) arithmetic and geometry is only built when written out
+    """
+    def __init__(self, x_linear, y_linear, mask=None, d=None):
+        """
+        :param x_linear: mesh x axis array
+        :param y_linear: mesh y axis array
+        :param mask: boolean validity array shaped x by y, all valid if None
+        :param d: square edge size
+        """
+        self.x = np.asarray(x_linear, dtype=float)
+        self.y = np.asarray(y_linear, dtype=float)
+        if mask is None:
+            mask = np.ones((self.x.size, self.y.size), dtype=bool)
+        self.mask = mask
+        self.d = d
+        self.data = {}
+        self._points = None
+        self._rank = None
+
+    @classmethod
+    def from_geometry(cls, geometry, xy_array, centre, d):
+        """
+        Return RegularGrid of square-mesh points inside geometry.
+        Centred on the point 'centre' and separated at a distance 'd'
+
+        :param geometry: Polygon or MultiPolygon geometry
+        :param xy_array: size of m, n
+        :param centre: GeoDataFrame centre-point
+        :param d: square edge size
+        """
+        x_linear, y_linear = get_meshaxes(xy_array, centre, d)
+        mask = np.zeros((x_linear.size, y_linear.size), dtype=bool)
+        mask[get_meshindex(geometry, x_linear, y_linear)] = True
+        return cls(x_linear, y_linear, mask, d)
+
+    @property
+    def shape(self):
+        return self.mask.shape
+
+    @property
+    def origin(self):
+        return np.asarray([self.x[0], self.y[0]])
+
+    @property
+    def spacing(self):
+        return np.asarray([v[1] - v[0] if v.size > 1 else self.d for v in [self.x, self.y]],
+                          dtype=float)
+
+    def __len__(self):
+        return int(self.mask.sum())
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def __setitem__(self, key, values):
+        values = np.asarray(values)
+        if values.ndim == 0:
+            values = np.full(len(self), values)
+        if values.shape[0] != len(self):
+            raise ValueError(f'{key} has {values.shape[0]} values for {len(self)} cells')
+        self.data[key] = values
+
+    @property
+    def points(self):
+        """
+        Return 2D numpy array of valid cell centre-points
+        """
+        if self._points is None:
+            j, k = np.nonzero(self.mask)
+            self._points = np.stack([self.x[j], self.y[k]], axis=-1)
+        return self._points
+
+    def get_cells(self, points):
+        """
+        Return valid-cell position of the cell containing each point,
+        or -1 where the cell is outside the grid or not valid
+
+        :param points: 2D numpy array of points
+        """
+        if self._rank is None:
+            self._rank = np.cumsum(self.mask, dtype=np.int32).reshape(self.shape) - 1
+            self._rank[~self.mask] = -1
+        jk = np.rint((points - self.origin) / self.spacing).astype(int)
+        idx = ((jk >= 0) & (jk < self.shape)).all(axis=1)
+        r = np.full(jk.shape[0], -1)
+        r[idx] = self._rank[tuple(jk[idx].T)]
+        return r
+
+    def get_subgrid(self, idx):
+        """
+        Return RegularGrid on the same axes with only the selected valid cells
+
+        :param idx: boolean array over valid cells
+        """
+        mask = np.zeros(self.shape, dtype=bool)
+        mask[tuple(np.nonzero(self.mask)[i][idx] for i in range(2))] = True
+        r = RegularGrid(self.x, self.y, mask, self.d)
+        for k, v in self.data.items():
+            r[k] = v[idx]
+        return r
+
+    def get_raster(self, key, fill=0.0):
+        """
+        Return 2D x by y numpy array of cell attribute, filled where not valid
+
+        :param key: attribute name
+        :param fill: value of cells that are not valid
+        """
+        r = np.full(self.shape, fill, dtype=np.result_type(self.data[key], fill))
+        r[self.mask] = self.data[key]
+        return r
+
+    def coarsen(self, factor, how=None):
+        """
+        Return RegularGrid aggregated over factor by factor blocks of cells.
+        A coarse cell is valid where any of its cells are valid, and each
+        attribute is reduced over the valid cells by 'sum', 'mean' or 'max'
+
+        :param factor: integer block size
+        :param how: dict of attribute reduction, 'sum' if not given
+        """
+        how = how or {}
+        m, n = -(-np.asarray(self.shape) // factor)
+        spacing = self.spacing
+        x_linear, y_linear = [v[0] + (np.arange(k) * factor + (factor - 1) / 2.0) * s
+                              for v, k, s in zip([self.x, self.y], [m, n], spacing)]
+
+        def get_blocks(values, fill):
+            r = np.full((m * factor, n * factor), fill, dtype=values.dtype)
+            r[:self.shape[0], :self.shape[1]] = values
+            return r.reshape(m, factor, n, factor)
+
+        count = get_blocks(self.mask, False).sum(axis=(1, 3))
+        mask = count > 0
+        d = None if self.d is None else self.d * factor
+        r = RegularGrid(x_linear, y_linear, mask, d)
+        for k in self.data:
+            reduction = how.get(k, 'sum')
+            if reduction == 'max':
+                fill = self.data[k].min()
+                values = get_blocks(self.get_raster(k, fill), fill).max(axis=(1, 3))
+            elif reduction in ('sum', 'mean'):
+                values = get_blocks(self.get_raster(k), 0).sum(axis=(1, 3))
+                if reduction == 'mean':
+                    values = values / np.maximum(count, 1)
+            else:
+                raise ValueError(f'unknown reduction {reduction}')
+            r[k] = values[mask]
+        return r
+
+    def to_frame(self, columns=None, d=None, boost=0.0, crs=CRS):
+        """
+        Return GeoDataFrame of cell attributes with centre-point geometry,
+        or square geometry of side 'd'
+
+        :param columns: attribute names, all if None
+        :param d: square-side length, or points if None
+        :param boost: square-side overlap
+        :param crs: geographic projection code
+        """
+        if columns is None:
+            columns = list(self.data)
+        data = {k: self.data[k] for k in columns}
+        if d is None:
+            geometry = gp.points_from_xy(*self.points.T)
+        else:
+            geometry = get_polygons(self.points, d / 2.0, boost)
+        return gp.GeoDataFrame(data=data, geometry=geometry).set_crs(crs)
+
+def get_pyramid(grid, levels, how=None):
+    """
+    Return dict of RegularGrid aggregated from grid at each level square
+    edge size, each an integer multiple of the grid square edge size
+
+    :param grid: finest level RegularGrid
+    :param levels: list of square edge sizes
+    :param how: dict of attribute reduction, 'sum' if not given
+    """
+    r = {}
+    for d in levels:
+        factor = int(round(d / grid.d))
+        if factor * grid.d != d:
+            raise ValueError(f'{d} is not a multiple of {grid.d}')
+        r[d] = grid.coarsen(factor, how)
+    return r
 
 def get_meshframe(gf, centre, d, crs=CRS):
     """
@@ -115,11 +367,7 @@ def get_meshframe(gf, centre, d, crs=CRS):
     :param crs: geographic projection code
     """
     extent = get_extent(gf, d)
-    mesh = get_mesharray(extent, centre, d)
-    r = gp.GeoDataFrame(geometry=gp.points_from_xy(*mesh.T)).set_crs(crs)
-    r = gp.clip(r, gf['geometry'])
-    r = r.loc[r.index]
-    return r.reset_index(drop=True)
+    return RegularGrid.from_geometry(gf['geometry'], extent, centre, d).to_frame(crs=crs)
 
 def get_meshpoints(gf, d, crs=CRS):
     """
@@ -154,6 +402,59 @@ def get_squares(points, d, boost=0.0):
                       points + d,
                       points + np.array([d, -d])]).reshape(-1, 4, 2)
 
+def get_polygons(points, d, boost=0.0):
+    """
+    Return numpy array of square Polygons built in one vectorised call.
+    Each square centred on the point in 'points' and length 'd'
+
+    :param points: 2D numpy array of square centre points
+    :param d: square-side length
+    :param boost: square-side overlap
+    """
+    return shapely.polygons(get_squares(points, d, boost))
+
+def get_spacing(points, d=None):
+    """
+    Return x, y lattice spacing of 2D numpy array of regular mesh points.
+    Use 'd' along an axis with a single row or column of points
+
+    :param points: 2D numpy array of mesh points
+    :param d: default square-side length
+    """
+    r = [np.diff(np.unique(v)) for v in points.T]
+    return np.asarray([v.min() if v.size else d for v in r], dtype=float)
+
+
+def get_linestrings(points, index, offsets=None):
+    """
+    Return numpy arrays of LineStrings and their lengths built in one
+    vectorised call from 2D numpy array of point coordinates.
+    Either 'index' is a 2D array of point positions, one row per line, or
+    a flat array of point positions split into lines at 'offsets'.
+    Lines of fewer than two points are empty with zero length
+
+    :param points: 2D numpy array of point coordinates
+    :param index: 2D or flat array of point positions
+    :param offsets: array of line start positions in index, ending with len(index)
+    """
+    index = np.asarray(index, dtype=int)
+    if offsets is None:
+        n, m = index.shape if index.size else (len(index), 0)
+        offsets = np.arange(n + 1) * m
+        index = index.reshape(-1)
+    count = np.diff(offsets)
+    n = len(count)
+    line = np.repeat(np.arange(n), count)
+    xy = np.asarray(points, dtype=float)[index]
+    segment = np.hypot(*np.diff(xy, axis=0).T) if len(xy) else np.zeros(0)
+    idx = line[1:] == line[:-1]
+    lengths = np.bincount(line[1:][idx], segment[idx], minlength=n)
+    lines = np.full(n, LineString(), dtype=object)
+    jdx = count[line] > 1
+    if jdx.any():
+        k = np.flatnonzero(count > 1)
+        lines[k] = shapely.linestrings(xy[jdx], indices=np.searchsorted(k, line[jdx]))
+    return lines, lengths
 
 def get_pairs(triangles):
     """
@@ -170,7 +471,7 @@ def get_pairs(triangles):
             r.append(next(j))
     return r
 
-def get_lines(triangles, data, points, crs=CRS):
+def get_lines(triangles, data, points, crs=CRS, length=None):
     """
     Return a GeoDataFrame deduplicated lines from an array of triangles
 
@@ -178,13 +479,157 @@ def get_lines(triangles, data, points, crs=CRS):
     :param data: data column values for lines
     :param points: numpy array of triangle point coordinates
     :param crs: geographic projection code
+    :param length: column name for line lengths, not added if None
     """
     s = np.array(list({tuple(sorted(i)) for i in get_pairs(triangles)}))
-    this_geometry = [LineString(i) for i in points[s]]
+    this_geometry, lengths = get_linestrings(points, s.reshape(-1, 2))
     r = gp.GeoDataFrame(columns=['from', 'to'], data=data[s], geometry=this_geometry)
+    if length is not None:
+        r[length] = lengths
     r.index = ['L{(str(i+1).zfill(5))}' for i in r.index]
     return r.set_crs(crs)
 
+def get_adjacency(gf1, gf2=None, predicate='touches'):
+    """
+    Return 2D array of gf1 and gf2 geometry position pairs that meet a
+    predicate, found in one bulk STRtree query on gf2.
+    If gf2 is None return pairs within gf1 once, lower position first
+
+    :param gf1: GeoDataFrame or GeoSeries
+    :param gf2: GeoDataFrame or GeoSeries
+    :param predicate: shapely binary predicate
+    """
+    g1 = np.asarray(gf1.geometry.values)
+    g2 = g1 if gf2 is None else np.asarray(gf2.geometry.values)
+    r = shapely.STRtree(g2).query(g1, predicate=predicate)
+    if gf2 is None:
+        r = r[:, r[0] < r[1]]
+    return r.T
+
+def get_borders(gf1, gf2=None):
+    """
+    Return 2D array of touching gf1 and gf2 polygon position pairs and
+    array of their shared border lengths
+
+    :param gf1: GeoDataFrame or GeoSeries of polygons
+    :param gf2: GeoDataFrame or GeoSeries of polygons
+    """
+    r = get_adjacency(gf1, gf2, 'touches')
+    g1 = np.asarray(gf1.geometry.values)
+    g2 = g1 if gf2 is None else np.asarray(gf2.geometry.values)
+    return r, shapely.length(shapely.intersection(g1[r[:, 0]], g2[r[:, 1]]))
+
+def get_longest_border(gf1, gf2):
+    """
+    Return array of the position of the gf2 polygon with the longest
+    shared border with each gf1 polygon, -1 where none touch
+
+    :param gf1: GeoDataFrame or GeoSeries of polygons
+    :param gf2: GeoDataFrame or GeoSeries of polygons
+    """
+    pairs, lengths = get_borders(gf1, gf2)
+    idx = np.lexsort((-lengths, pairs[:, 0]))
+    idx = idx[np.unique(pairs[idx, 0], return_index=True)[1]]
+    r = np.full(len(gf1), -1)
+    r[pairs[idx, 0]] = pairs[idx, 1]
+    return r
+
+def get_within(gf1, gf2, key=None, predicate='within'):
+    """
+    Return array of the position of the gf2 polygon that contains each gf1
+    geometry, found in one bulk STRtree join, -1 where none does.
+    Where several contain a geometry take the last, skipping polygons with
+    the same key value as the geometry. So each geometry has one polygon,
+    unlike clip, which keeps a boundary geometry in every polygon it touches
+
+    :param gf1: GeoDataFrame or GeoSeries
+    :param gf2: GeoDataFrame or GeoSeries of polygons
+    :param key: column in gf1 and gf2
+    :param predicate: 'within' or 'intersects' to include boundary points
+    """
+    pairs = get_adjacency(gf1, gf2, predicate)
+    if key is not None:
+        pairs = pairs[gf1[key].values[pairs[:, 0]] != gf2[key].values[pairs[:, 1]]]
+    r = np.full(len(gf1), -1)
+    np.maximum.at(r, pairs[:, 0], pairs[:, 1])
+    return r
+
+def get_nearest(gf1, gf2):
+    """
+    Return array of the position of the nearest gf2 geometry to each gf1
+    geometry, the lowest position where several are equally near
+
+    :param gf1: GeoDataFrame or GeoSeries
+    :param gf2: GeoDataFrame or GeoSeries
+    """
+    g1 = np.asarray(gf1.geometry.values)
+    g2 = np.asarray(gf2.geometry.values)
+    r = shapely.STRtree(g2).query_nearest(g1, all_matches=True)
+    s = np.full(len(g1), len(g2))
+    np.minimum.at(s, r[0], r[1])
+    return s
+
+def get_union(geometry):
+    """
+    Return union of a polygon array. Use coverage union, which only removes
+    shared edges, where the polygons form a valid edge-matched coverage,
+    otherwise general unary union
+
+    :param geometry: numpy array of polygons
+    """
+    if hasattr(shapely, 'coverage_is_valid') and not shapely.coverage_is_valid(geometry):
+        return shapely.union_all(geometry)
+    try:
+        r = shapely.coverage_union_all(geometry)
+    except shapely.errors.GEOSException:
+        return shapely.union_all(geometry)
+    if r.is_valid and np.isclose(r.area, shapely.area(geometry).sum()):
+        return r
+    return shapely.union_all(geometry)
+
+def get_unions(groups):
+    """
+    Return list of unions of GEOMETRY position arrays
+
+    :param groups: list of GEOMETRY position arrays
+    """
+    return [get_union(GEOMETRY[i]) for i in groups]
+
+def dissolve(gf, by=None, aggfunc='first', processes=1, **kwargs):
+    """
+    Return GeoDataFrame dissolved by column values as GeoDataFrame.dissolve,
+    with each group geometry unioned by get_union. Rows with a missing key
+    are dropped, and only observed categories are kept. Where processes > 1
+    union groups over a forked process pool
+
+    :param gf: GeoDataFrame
+    :param by: column or list of columns to group by, all rows if None
+    :param aggfunc: data column aggregate function
+    :param processes: number of worker processes
+    :param kwargs: aggregate function keyword arguments
+    """
+    global GEOMETRY
+    if by is None:
+        by = np.zeros(len(gf), dtype='int64')
+    name = gf.geometry.name
+    groupby = gf.drop(columns=name).groupby(by, observed=True)
+    data = groupby.agg(aggfunc, **kwargs)
+    data.columns = data.columns.to_flat_index()
+    codes = groupby.ngroup().fillna(-1).to_numpy(dtype=np.int64)
+    order = np.argsort(codes, kind='stable')
+    count = np.bincount(codes[codes >= 0], minlength=len(data))
+    groups = np.split(order[np.sum(codes < 0):], np.cumsum(count)[:-1])
+    GEOMETRY = np.asarray(gf.geometry.values)
+    if processes is None or processes < 2:
+        geometry = get_unions(groups)
+    else:
+        chunks = np.array_split(np.arange(len(groups)), 4 * processes)
+        tasks = [[groups[j] for j in i] for i in chunks if len(i)]
+        geometry = [g for r in pool_map(get_unions, tasks, processes) for g in r]
+    GEOMETRY = None
+    r = gp.GeoDataFrame({name: geometry}, index=data.index, geometry=name, crs=gf.crs)
+    return r.join(data)
+
 def gf_reduce_mem_usage(gf, output=True, drop=True):
     """ iterate through all the columns of a GeoDataFrame, drop non-numerical
         data and modify the data type to reduce memory usag
@@ -0,0 +1,304 @@
+"""
+Module with network graph and path functions
+"""
+
+import numpy as np
+import pandas as pd
+import geopandas as gp
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra, minimum_spanning_tree
+from .geometry import CRS, get_linestrings, get_points
+
+class PathCache:
+    """
+    Shortest paths on a weighted network. Dijkstra distance and predecessor
+    trees are computed once per source node with scipy.sparse.csgraph, and
+    node sequence, distance and geometry queries are answered from them
+    """
+
+    def __init__(self, source, target, weight, directed=False):
+        """
+        :param source: edge source node label array
+        :param target: edge target node label array
+        :param weight: edge weight array
+        :param directed: edges are one-way
+        """
+        self.nodes = pd.Index(np.unique(np.concatenate([source, target])))
+        u = self.nodes.get_indexer(source)
+        v = self.nodes.get_indexer(target)
+        w = np.asarray(weight, dtype=float)
+        # keep the lightest of any parallel edges
+        idx = np.lexsort((w, v, u))
+        u, v, w = u[idx], v[idx], w[idx]
+        idx = np.ones(len(u), dtype=bool)
+        idx[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+        n = len(self.nodes)
+        self.graph = csr_matrix((w[idx], (u[idx], v[idx])), shape=(n, n))
+        self.directed = directed
+        self.distance = {}
+        self.predecessor = {}
+
+    @classmethod
+    def from_frame(cls, df, weight='weight', source='source', target='target', directed=False):
+        """
+        Return PathCache from DataFrame edgelist
+
+        :param df: DataFrame with edge source, target and weight columns
+        :param weight: weight column
+        :param source: source column
+        :param target: target column
+        :param directed: edges are one-way
+        """
+        return cls(df[source].values, df[target].values, df[weight].values, directed)
+
+    def update(self, sources):
+        """
+        Compute distance and predecessor trees for node positions not cached
+
+        :param sources: source node position array
+        """
+        sources = np.setdiff1d(sources, list(self.distance))
+        sources = sources[sources >= 0]
+        if sources.size == 0:
+            return
+        d, p = dijkstra(self.graph, self.directed, indices=sources, return_predecessors=True)
+        for i, j in enumerate(sources):
+            self.distance[j] = d[i]
+            self.predecessor[j] = p[i]
+
+    def get_index(self, pairs):
+        """
+        Return source and target node position arrays for node label pairs,
+        -1 where a label is not a network node
+
+        :param pairs: list of source and target node label pairs
+        """
+        pairs = np.asarray(list(pairs)).reshape(-1, 2)
+        u = self.nodes.get_indexer(pairs[:, 0])
+        v = self.nodes.get_indexer(pairs[:, 1])
+        self.update(u)
+        return u, v
+
+    def get_path(self, u, v):
+        """
+        Return node label list of shortest path between node positions,
+        empty if there is no path
+
+        :param u: source node position
+        :param v: target node position
+        """
+        if u < 0 or v < 0 or not np.isfinite(self.distance[u][v]):
+            return []
+        predecessor = self.predecessor[u]
+        r = [v]
+        while r[-1] != u:
+            r.append(predecessor[r[-1]])
+        return self.nodes[r[::-1]].to_list()
+
+    def get_paths(self, pairs):
+        """
+        Return list of shortest path node label lists for node label pairs,
+        empty where there is no path
+
+        :param pairs: list of source and target node label pairs
+        """
+        return [self.get_path(i, j) for i, j in zip(*self.get_index(pairs))]
+
+    def get_distances(self, pairs):
+        """
+        Return shortest path distance array for node label pairs, infinite
+        where there is no path
+
+        :param pairs: list of source and target node label pairs
+        """
+        u, v = self.get_index(pairs)
+        return np.array([self.distance[i][j] if i >= 0 and j >= 0 else np.inf
+                         for i, j in zip(u, v)])
+
+    def get_lines(self, pairs, points, crs=CRS):
+        """
+        Return GeoSeries of shortest path LineStrings for node label pairs
+        and numpy array of their lengths, empty and zero where there is no path
+
+        :param pairs: list of source and target node label pairs
+        :param points: GeoSeries of node Points indexed by node label
+        :param crs: geographic projection code
+        """
+        paths = self.get_paths(pairs)
+        offsets = np.cumsum([0] + [len(i) for i in paths])
+        index = points.index.get_indexer([j for i in paths for j in i])
+        if (index < 0).any():
+            raise KeyError('path node not in points index')
+        r, lengths = get_linestrings(get_points(points), index, offsets)
+        return gp.GeoSeries(r).rename('geometry').set_crs(crs), lengths
+
+class Graph:
+    """
+    Network held in NumPy arrays: node labels and coordinates, and edge
+    source and target node positions in CSR order with edge attribute
+    columns. Undirected graphs hold each edge once with source position
+    before target, and route in both directions
+    """
+
+    def __init__(self, source, target, nodes, points=None, data=None, directed=False):
+        """
+        :param source: edge source node position array
+        :param target: edge target node position array
+        :param nodes: node label array
+        :param points: 2D numpy array of node coordinates
+        :param data: DataFrame of edge attribute columns in edge order
+        :param directed: edges are one-way
+        """
+        source = np.asarray(source, dtype=int)
+        target = np.asarray(target, dtype=int)
+        if not directed:
+            source, target = np.minimum(source, target), np.maximum(source, target)
+        idx = np.lexsort((target, source))
+        self.source = source[idx]
+        self.target = target[idx]
+        self.nodes = pd.Index(nodes)
+        self.points = None if points is None else np.asarray(points, dtype=float)
+        if data is None:
+            data = pd.DataFrame(index=range(len(idx)))
+        self.data = data.iloc[idx].reset_index(drop=True)
+        self.indptr = np.searchsorted(self.source, np.arange(len(self.nodes) + 1))
+        self.directed = directed
+
+    def __len__(self):
+        return len(self.source)
+
+    @classmethod
+    def from_weights(cls, w, gf=None):
+        """
+        Return undirected Graph from libpysal spatial weights with node
+        coordinates from GeoDataFrame Points in weights id order
+
+        :param w: libpysal W
+        :param gf: GeoDataFrame or GeoSeries of node Points
+        """
+        r = w.sparse.tocoo()
+        idx = r.row < r.col
+        points = None if gf is None else get_points(gf)
+        return cls(r.row[idx], r.col[idx], w.id_order, points)
+
+    @classmethod
+    def from_frame(cls, gf, source='source', target='target', nodes=None, points=None,
+                   directed=False):
+        """
+        Return Graph from GeoDataFrame edgelist, with remaining columns as
+        edge attributes
+
+        :param gf: GeoDataFrame or DataFrame with edge source and target columns
+        :param source: source column
+        :param target: target column
+        :param nodes: node label array, unique source and target labels if None
+        :param points: 2D numpy array of node coordinates
+        :param directed: edges are one-way
+        """
+        if nodes is None:
+            nodes = np.unique(np.concatenate([gf[source].values, gf[target].values]))
+        nodes = pd.Index(nodes)
+        u = nodes.get_indexer(gf[source].values)
+        v = nodes.get_indexer(gf[target].values)
+        if (u < 0).any() or (v < 0).any():
+            raise KeyError('edge node not in nodes')
+        data = gf.drop(columns=[source, target]).reset_index(drop=True)
+        return cls(u, v, nodes, points, data, directed)
+
+    def to_frame(self, crs=CRS, length=None):
+        """
+        Return GeoDataFrame edgelist with source and target node labels and
+        edge attributes, with straight line geometry from node coordinates
+        unless edges have geometry
+
+        :param crs: geographic projection code
+        :param length: column name for straight line lengths, not added if None
+        """
+        r = self.data.copy()
+        r.insert(0, 'source', self.nodes[self.source])
+        r.insert(1, 'target', self.nodes[self.target])
+        if 'geometry' not in r or length is not None:
+            lines, lengths = get_linestrings(self.points, np.stack([self.source, self.target], axis=1))
+        if 'geometry' not in r:
+            r['geometry'] = lines
+        if length is not None:
+            r[length] = lengths
+        return gp.GeoDataFrame(r, geometry='geometry', crs=crs)
+
+    def to_directed(self):
+        """
+        Return directed Graph with an edge in each direction of each
+        undirected edge, ordered as networkx to_directed
+        """
+        if self.directed:
+            return self
+        data = pd.concat([self.data, self.data])
+        return Graph(np.concatenate([self.source, self.target]),
+                     np.concatenate([self.target, self.source]),
+                     self.nodes, self.points, data, True)
+
+    def prune(self, mask):
+        """
+        Return Graph with the same nodes keeping edges where mask is True
+
+        :param mask: boolean edge array
+        """
+        mask = np.asarray(mask, dtype=bool)
+        return Graph(self.source[mask], self.target[mask], self.nodes, self.points,
+                     self.data[mask], self.directed)
+
+    def get_degree(self):
+        """
+        Return node degree array
+        """
+        n = len(self.nodes)
+        return np.bincount(self.source, minlength=n) + np.bincount(self.target, minlength=n)
+
+    def get_csr(self, weight=None):
+        """
+        Return CSR adjacency matrix of edge weights, symmetric if undirected,
+        keeping the lightest of any parallel edges
+
+        :param weight: edge weight column, 1 if None
+        """
+        if weight is None:
+            w = np.ones(len(self))
+        else:
+            w = self.data[weight].to_numpy(dtype=float)
+        u, v = self.source, self.target
+        if not self.directed:
+            u, v, w = np.concatenate([u, v]), np.concatenate([v, u]), np.concatenate([w, w])
+        idx = np.lexsort((w, v, u))
+        u, v, w = u[idx], v[idx], w[idx]
+        idx = np.ones(len(u), dtype=bool)
+        idx[1:] = (u[1:] != u[:-1]) | (v[1:] != v[:-1])
+        n = len(self.nodes)
+        return csr_matrix((w[idx], (u[idx], v[idx])), shape=(n, n))
+
+    def minimum_spanning_tree(self, weight):
+        """
+        Return undirected Graph of minimum spanning tree or forest edges by
+        positive edge weight
+
+        :param weight: edge weight column
+        """
+        r = minimum_spanning_tree(self.get_csr(weight)).tocoo()
+        u, v = np.minimum(r.row, r.col), np.maximum(r.row, r.col)
+        n = len(self.nodes)
+        w = self.data[weight].to_numpy(dtype=float)
+        key = np.minimum(self.source, self.target) * n + np.maximum(self.source, self.target)
+        idx = np.lexsort((w, key))
+        jdx = idx[np.searchsorted(key[idx], u * n + v)]
+        mask = np.zeros(len(self), dtype=bool)
+        mask[jdx] = True
+        return Graph(self.source[mask], self.target[mask], self.nodes, self.points,
+                     self.data[mask], False)
+
+    def get_pathcache(self, weight):
+        """
+        Return PathCache of shortest paths by edge weight between node labels
+
+        :param weight: edge weight column
+        """
+        return PathCache(self.nodes[self.source], self.nodes[self.target],
+                         self.data[weight].values, self.directed)
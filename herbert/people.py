@@ -2,10 +2,23 @@
 Module with population statistic functions
 """
 
+import os
+import pickle
+from zipfile import BadZipFile
+import numpy as np
+import pandas as pd
 import geopandas as gp
 from scipy.spatial import cKDTree
-from shapely.geometry import Polygon
-from .geometry import CRS, get_points, get_squares
+from scipy.signal import fftconvolve
+from .base import replace_file
+from .geometry import CRS, get_points, get_polygons, get_spacing
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+LEVELS = ['OA', 'LSOA', 'MSOA', 'Country']
 
 def get_density(df):
     """
@@ -15,7 +28,360 @@ def get_density(df):
     """
     return (1.0E6 * df['population'] / df['area'] ).round(1)
 
-def get_heatframe(points, this_frame, key, n_count=15, crs=CRS):
+def get_tree(this_frame):
+    """
+    Return k-d tree spatial index of GeoDataFrame Points geometry
+
+    :param this_frame: GeoDataFrame
+    """
+    return cKDTree(get_points(this_frame))
+
+def get_treepath(filepath, layer):
+    """
+    Return filepath of k-d tree index stored next to GeoPKG layer
+
+    :param filepath: GeoPKG filepath
+    :param layer: layer name
+    """
+    stub = os.path.splitext(filepath)[0]
+    return f'{stub}-{layer}.kdtree'
+
+def write_tree(tree, filepath):
+    """
+    Write k-d tree index to filepath through a unique temporary file
+
+    :param tree: cKDTree
+    :param filepath: index filepath
+    """
+    with replace_file(filepath) as fout:
+        pickle.dump(tree, fout, protocol=pickle.HIGHEST_PROTOCOL)
+
+def read_tree(filepath, layer, this_frame):
+    """
+    Return k-d tree index for GeoPKG layer read into this_frame.
+    Load index stored next to the GeoPKG, or build and store it when it is
+    missing or its points no longer match this_frame
+
+    :param filepath: GeoPKG filepath
+    :param layer: layer name
+    :param this_frame: GeoDataFrame read from layer
+    """
+    treepath = get_treepath(filepath, layer)
+    try:
+        with open(treepath, 'rb') as fin:
+            tree = pickle.load(fin)
+        if np.array_equal(tree.data, get_points(this_frame)):
+            return tree
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        pass
+    tree = get_tree(this_frame)
+    write_tree(tree, treepath)
+    return tree
+
+class Hierarchy:
+    """
+    Census geography hierarchy with each OA mapped to a dense integer code
+    at every level, held as arrays in OA order with each level's labels in
+    code order, so that sums at any level are a single bincount
+    """
+
+    def __init__(self, codes, labels):
+        """
+        :param codes: dict of level and code array in OA order, -1 where missing
+        :param labels: dict of level and label array in code order
+        """
+        self.codes = codes
+        self.labels = labels
+
+    @classmethod
+    def from_frame(cls, df, levels=LEVELS):
+        """
+        Return Hierarchy from OA DataFrame with a label column per level
+
+        :param df: DataFrame with level columns
+        :param levels: level columns, finest first
+        """
+        codes, labels = {}, {}
+        for k in levels:
+            code, label = pd.factorize(df[k], sort=True)
+            codes[k] = code.astype(np.int32)
+            labels[k] = np.asarray(label, dtype=str)
+        return cls(codes, labels)
+
+    @property
+    def levels(self):
+        return list(self.codes)
+
+    def get_sum(self, level, values):
+        """
+        Return array of OA values summed by level code
+
+        :param level: level name
+        :param values: value array in OA order
+        """
+        code = self.codes[level]
+        idx = code >= 0
+        values = np.asarray(values, dtype=float)[idx]
+        return np.bincount(code[idx], weights=values, minlength=len(self.labels[level]))
+
+    def get_parent(self, level, parent):
+        """
+        Return array of parent level code for each level code
+
+        :param level: level name
+        :param parent: coarser level name
+        """
+        r = np.full(len(self.labels[level]), -1, dtype=np.int32)
+        idx = self.codes[level] >= 0
+        r[self.codes[level][idx]] = self.codes[parent][idx]
+        return r
+
+    def get_frame(self, level, df, fields=('area', 'population')):
+        """
+        Return DataFrame of level labels, coarser level labels, OA fields
+        summed to level and density
+
+        :param level: level name
+        :param df: OA DataFrame in hierarchy OA order
+        :param fields: OA columns to sum
+        """
+        r = pd.DataFrame({level: self.labels[level]})
+        for k in self.levels[self.levels.index(level) + 1:]:
+            code = self.get_parent(level, k)
+            r[k] = np.where(code >= 0, self.labels[k][code], None)
+        for k in fields:
+            r[k] = self.get_sum(level, df[k].values).astype(df[k].dtype)
+        r['density'] = get_density(r)
+        return r
+
+def get_hierarchypath(filepath):
+    """
+    Return filepath of census hierarchy stored next to GeoPKG
+
+    :param filepath: GeoPKG filepath
+    """
+    stub = os.path.splitext(filepath)[0]
+    return f'{stub}-hierarchy.npz'
+
+def write_hierarchy(hierarchy, filepath):
+    """
+    Write census hierarchy codes and labels to filepath through a unique
+    temporary file
+
+    :param hierarchy: Hierarchy
+    :param filepath: hierarchy filepath
+    """
+    data = {}
+    for k in hierarchy.levels:
+        data[f'{k} codes'] = hierarchy.codes[k]
+        data[f'{k} labels'] = hierarchy.labels[k]
+    with replace_file(filepath) as fout:
+        np.savez(fout, **data)
+
+def read_hierarchy(filepath, this_frame, levels=LEVELS):
+    """
+    Return census hierarchy for GeoPKG OA layer read into this_frame.
+    Load hierarchy stored next to the GeoPKG, or build and store it when it
+    is missing or its OA no longer match this_frame
+
+    :param filepath: GeoPKG filepath
+    :param this_frame: DataFrame read from OA layer with level columns
+    :param levels: level columns, finest first
+    """
+    hierarchypath = get_hierarchypath(filepath)
+    try:
+        with np.load(hierarchypath) as fin:
+            codes = {k: fin[f'{k} codes'] for k in levels}
+            labels = {k: fin[f'{k} labels'] for k in levels}
+        k = levels[0]
+        if np.array_equal(labels[k][codes[k]], this_frame[k].values.astype(str)):
+            return Hierarchy(codes, labels)
+    except (FileNotFoundError, KeyError, ValueError, EOFError, BadZipFile):
+        pass
+    hierarchy = Hierarchy.from_frame(this_frame, levels)
+    write_hierarchy(hierarchy, hierarchypath)
+    return hierarchy
+
+if njit is not None:
+    @njit(parallel=True)
+    def get_heatkernel(d, i, values):
+        """
+        Return inverse-distance 'distance', 'weight' and 'weight2' arrays
+        in a single compiled pass over each point's k-nearest arrays
+
+        :param d: k-nearest distance array
+        :param i: k-nearest index array
+        :param values: weight values
+        """
+        n, k = d.shape
+        u = np.empty(n)
+        v = np.empty(n)
+        w = np.empty(n)
+        for p in prange(n):
+            s, sv, sw = 0.0, 0.0, 0.0
+            for j in range(k):
+                x = 1.0 * values[i[p, j]]
+                s += d[p, j]
+                sv += x / d[p, j]
+                sw += x * x / d[p, j]
+            u[p] = 1.0E3 / s
+            v[p] = sv
+            w[p] = sw
+        return u, v, w
+
+def get_heatweights(d, i, values, compiled=True):
+    """
+    Return inverse-distance 'distance', 'weight' and 'weight2' arrays
+    from k-nearest distance and index arrays.
+    Use the numba kernel if available, otherwise NumPy
+
+    :param d: k-nearest distance array
+    :param i: k-nearest index array
+    :param values: weight values
+    :param compiled: use numba kernel if available
+    """
+    if compiled and njit is not None:
+        return get_heatkernel(d, i, values)
+    u = 1.0E3 / d.sum(1)
+    v = (1.0 * values[i] / d).sum(1)
+    w = (1.0 * values[i] * values[i] / d).sum(1)
+    return u, v, w
+
+def get_blocksize(n_count, memory):
+    """
+    Return number of points per k-nearest query block that keeps the
+    distance, index and two weight temporary arrays within memory bytes
+
+    :param n_count: number of nearest points
+    :param memory: memory budget in bytes
+    """
+    return max(1, int(memory // (4 * 8 * n_count)))
+
+def get_kernel(kernel, radius, spacing):
+    """
+    Return 2D convolution weight and distance kernel arrays of given radius
+    on a lattice with x, y spacing.
+    Kernels are 'idw' inverse-distance, 'gaussian' or 'uniform', scaled to
+    the same total weight as 'idw' so all match k-nearest weight units
+
+    :param kernel: kernel name
+    :param radius: kernel radius
+    :param spacing: x, y lattice spacing
+    """
+    n = np.ceil(radius / spacing).astype(int)
+    x, y = [np.arange(-i, i + 1) * s for i, s in zip(n, spacing)]
+    r = np.hypot(*np.meshgrid(x, y, indexing='ij'))
+    d = np.maximum(r, spacing.min() / 2.0)
+    if kernel == 'idw':
+        k = 1.0 / d
+    elif kernel == 'gaussian':
+        k = np.exp(-4.5 * (r / radius) ** 2)
+    elif kernel == 'uniform':
+        k = np.ones(r.shape)
+    else:
+        raise ValueError(f'unknown kernel {kernel}')
+    idx = r > radius
+    k[idx] = 0.0
+    k = k * (1.0 / d[~idx]).sum() / k.sum()
+    d[idx] = 0.0
+    return k, d
+
+def get_fftvalues(grid, this_frame, key, n_count=15, kernel='idw', d=None):
+    """
+    Return 'distance', 'weight' and 'weight2' arrays on a regular mesh by
+    binning this_frame points onto the mesh lattice and FFT convolution with
+    a kernel of radius that covers n_count points on average, and at least
+    one mesh cell.
+    'distance' is NaN where no source point is within the radius
+
+    :param grid: 2D numpy array of regular mesh points
+    :param this_frame: GeoDataFrame source points
+    :param key: source weight column
+    :param n_count: average number of source points within kernel radius
+    :param kernel: kernel name
+    :param d: mesh square-side length, inferred from points if None
+    """
+    source = get_points(this_frame)
+    spacing = get_spacing(grid, d)
+    lower, upper = grid.min(axis=0), grid.max(axis=0)
+    area = np.prod(upper - lower + spacing)
+    count = ((source >= lower) & (source <= upper)).all(axis=1).sum()
+    radius = max(np.sqrt(n_count * area / np.pi / max(count, 1)), spacing.max())
+    k, r = get_kernel(kernel, radius, spacing)
+
+    margin = np.asarray(k.shape) // 2
+    origin = lower - margin * spacing
+    shape = np.rint((upper - lower) / spacing).astype(int) + 2 * margin + 1
+    cell = np.rint((source - origin) / spacing).astype(int)
+    idx = ((cell >= 0) & (cell < shape)).all(axis=1)
+    flat = np.ravel_multi_index(cell[idx].T, shape)
+    values = 1.0 * np.asarray(this_frame[key])[idx]
+
+    def get_surface(weights, this_kernel):
+        raster = np.bincount(flat, weights, np.prod(shape)).reshape(shape)
+        return np.maximum(fftconvolve(raster, this_kernel, mode='same'), 0.0)
+
+    cell = tuple(np.rint((grid - origin) / spacing).astype(int).T)
+    # mean distance s / c to the c source points within the radius, scaled
+    # to the sum over the n_count nearest, whose radius is sqrt(n_count / c)
+    # of the kernel radius, as k-nearest 'distance'. NaN if there are none
+    s = get_surface(np.ones(values.shape), r)[cell]
+    c = np.rint(get_surface(np.ones(values.shape), 1.0 * (r > 0.0))[cell])
+    u = np.full(s.shape, np.nan)
+    idx = (c > 0.0) & (s > 0.0)
+    u[idx] = 1.0E3 * c[idx] / (n_count * s[idx] * np.sqrt(n_count / c[idx]))
+    v = get_surface(values, k)[cell]
+    w = get_surface(values * values, k)[cell]
+    return u, v, w
+
+def get_fftframe(points, this_frame, key, n_count=15, kernel='idw', d=None, crs=CRS):
+    """
+    Return GeoDataFrame with 'distance', 'weight' and 'weight2' surfaces
+    on a regular mesh from FFT convolution
+
+    :param points: GeoDataFrame regular mesh points
+    :param this_frame: GeoDataFrame source points
+    :param key: source weight column
+    :param n_count: average number of source points within kernel radius
+    :param kernel: kernel name
+    :param d: mesh square-side length, inferred from points if None
+    :param crs: geographic projection code
+    """
+    u, v, w = get_fftvalues(get_points(points), this_frame, key, n_count, kernel, d)
+    return gp.GeoDataFrame(data={'distance': u, 'weight': v, 'weight2': w},
+                           geometry=points['geometry']).set_crs(crs)
+
+def get_heatvalues(grid, this_frame, key, n_count=15, tree=None, memory=None):
+    """
+    Return k-nearest inverse-distance 'distance', 'weight' and 'weight2' arrays
+
+    :param grid: 2D numpy array of points
+    :param this_frame: GeoDataFrame source points
+    :param key: source weight column
+    :param n_count: number of nearest points
+    :param tree: k-d tree index of this_frame, built if None
+    :param memory: query memory budget in bytes, or a single query if None
+    """
+    if tree is None:
+        tree = get_tree(this_frame)
+    values = np.asarray(this_frame[key])
+    if memory is None:
+        d, i = tree.query(grid, n_count)
+        offset = int((d == 0.0).any())
+        u, v, w = get_heatweights(d[:, offset:], i[:, offset:], values)
+    else:
+        # drop nearest point from every block if any point is coincident
+        offset = int((tree.query(grid, 1)[0] == 0.0).any())
+        u, v, w = np.empty((3, grid.shape[0]))
+        n = get_blocksize(n_count, memory)
+        for j in range(0, grid.shape[0], n):
+            d, i = tree.query(grid[j:j + n], n_count)
+            r = get_heatweights(d[:, offset:], i[:, offset:], values)
+            u[j:j + n], v[j:j + n], w[j:j + n] = r
+    return u, v, w
+
+def get_heatframe(points, this_frame, key, n_count=15, crs=CRS, tree=None, memory=None,
+                  method='knn', kernel='idw', d=None):
     """
     Return GeoDataFrame 
 
@@ -24,22 +390,43 @@ def get_heatframe(points, this_frame, key, n_count=15, crs=CRS):
     :param key:
     :param n_count:
     :param crs:
+    :param tree: k-d tree index of this_frame, built if None
+    :param memory: query memory budget in bytes, or a single query if None
+    :param method: 'knn' k-nearest inverse-distance or 'fft' convolution
+    :param kernel: 'fft' convolution kernel name
+    :param d: 'fft' mesh square-side length, inferred from points if None
     """
-    tree = cKDTree(get_points(this_frame))
-    grid = get_points(points)
-    d, i = tree.query(grid, n_count)
-    if (d == 0.0).any():
-        d = d.T[1:].T
-        i = i.T[1:].T
-
-    weight = this_frame[key]
-    u = 1.0E3 / d.sum(1)
-    v = (1.0 * weight.values[i] / d).sum(1)
-    w = (1.0 * weight.values[i] * weight.values[i] / d).sum(1)
+    if method == 'fft':
+        return get_fftframe(points, this_frame, key, n_count, kernel, d, crs)
+    u, v, w = get_heatvalues(get_points(points), this_frame, key, n_count, tree, memory)
     return gp.GeoDataFrame(data={'distance': u, 'weight': v, 'weight2': w},
                            geometry=points['geometry']).set_crs(crs)
 
-def get_heatmap(mesh, geography, i_class, d, connections=512, key='population', crs=CRS):
+def get_heatgrid(grid, this_frame, key, n_count=15, tree=None, memory=None,
+                 method='knn', kernel='idw'):
+    """
+    Set 'distance', 'weight' and 'weight2' cell attributes of RegularGrid
+    without building point geometry, and return the grid
+
+    :param grid: RegularGrid
+    :param this_frame: GeoDataFrame or RegularGrid source points
+    :param key: source weight column
+    :param n_count: number of nearest points
+    :param tree: k-d tree index of this_frame, built if None
+    :param memory: query memory budget in bytes, or a single query if None
+    :param method: 'knn' k-nearest inverse-distance or 'fft' convolution
+    :param kernel: 'fft' convolution kernel name
+    """
+    if method == 'fft':
+        r = get_fftvalues(grid.points, this_frame, key, n_count, kernel, grid.d)
+    else:
+        r = get_heatvalues(grid.points, this_frame, key, n_count, tree, memory)
+    for k, v in zip(['distance', 'weight', 'weight2'], r):
+        grid[k] = v
+    return grid
+
+def get_heatmap(mesh, geography, i_class, d, connections=512, key='population', crs=CRS,
+                tree=None, memory=None, method='knn', kernel='idw', squares=True):
     """
     Return GeoDataFrame 
 
@@ -50,9 +437,15 @@ def get_heatmap(mesh, geography, i_class, d, connections=512, key='population',
     :param key:
     :param connections:
     :param crs:
+    :param tree: k-d tree index of geography, built if None
+    :param memory: query memory budget in bytes, or a single query if None
+    :param method: 'knn' k-nearest inverse-distance or 'fft' convolution
+    :param kernel: 'fft' convolution kernel name
+    :param squares: replace point with square geometry
     """
-    heatmap = get_heatframe(mesh, geography, key, connections)
+    heatmap = get_heatframe(mesh, geography, key, connections, crs, tree, memory,
+                            method, kernel, d)
     heatmap['class'] = i_class
-    squares = get_squares(get_points(heatmap), d / 2.0, 0.2)
-    heatmap['geometry'] = [Polygon(v) for v in squares]
+    if squares:
+        heatmap['geometry'] = get_polygons(get_points(heatmap), d / 2.0, 0.2)
     return heatmap.set_crs(crs)
@@ -0,0 +1,204 @@
+"""
+Module with content-hash incremental pipeline functions
+"""
+
+import os
+import sys
+import json
+import hashlib
+import subprocess
+from glob import glob
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+STATEPATH = '.pipeline.json'
+
+def read_state(filepath=STATEPATH):
+    """
+    Return pipeline state dict of cached file hashes and stage keys
+
+    :param filepath: state filepath
+    """
+    try:
+        with open(filepath, 'r', encoding='utf-8') as fin:
+            return json.load(fin)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {'files': {}, 'stages': {}}
+
+def write_state(state, filepath=STATEPATH):
+    """
+    Write pipeline state dict
+
+    :param state: state dict
+    :param filepath: state filepath
+    """
+    with open(f'{filepath}.tmp', 'w', encoding='utf-8') as fout:
+        json.dump(state, fout, indent=1, sort_keys=True)
+    os.replace(f'{filepath}.tmp', filepath)
+
+def get_filepaths(patterns):
+    """
+    Return sorted list of filepaths matching glob patterns
+
+    :param patterns: list of filepath glob patterns
+    """
+    return sorted({f for i in patterns for f in (glob(i) or [i])})
+
+def get_filehash(filepath, state, blocksize=2**20):
+    """
+    Return sha256 hex digest of file content, reusing the hash cached in
+    state while file size and modification time are unchanged, or None if
+    the file does not exist
+
+    :param filepath: filepath
+    :param state: state dict with 'files' hash cache
+    :param blocksize: read block size
+    """
+    try:
+        stat = os.stat(filepath)
+    except FileNotFoundError:
+        return None
+    size, mtime, digest = state['files'].get(filepath, [None, None, None])
+    if (size, mtime) == (stat.st_size, stat.st_mtime_ns):
+        return digest
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as fin:
+        for block in iter(lambda: fin.read(blocksize), b''):
+            h.update(block)
+    digest = h.hexdigest()
+    state['files'][filepath] = [stat.st_size, stat.st_mtime_ns, digest]
+    return digest
+
+def get_stagekey(stage, state, sources=()):
+    """
+    Return sha256 hex digest of stage commands, parameters, inputs and
+    shared source files content
+
+    :param stage: stage dict with 'commands', 'inputs' and 'outputs'
+    :param state: state dict with 'files' hash cache
+    :param sources: list of filepath glob patterns shared by all stages
+    """
+    commands = [i[0] for i in stage['commands']]
+    filepaths = get_filepaths(commands + list(stage.get('inputs', [])) + list(sources))
+    h = hashlib.sha256()
+    h.update(json.dumps(stage['commands']).encode())
+    for filepath in filepaths:
+        h.update(f'{filepath}:{get_filehash(filepath, state)}\n'.encode())
+    return h.hexdigest()
+
+def get_command(command):
+    """
+    Return subprocess argument list for a stage command, running Python
+    scripts with the current interpreter and others with the shell
+
+    :param command: list of script filepath and arguments
+    """
+    if command[0].endswith('.py'):
+        return [sys.executable] + list(command)
+    return ['sh'] + list(command)
+
+def get_upstream(stages):
+    """
+    Return dict of stage name and set of stage names producing its inputs
+
+    :param stages: dict of stage name and stage dict
+    """
+    producers = {f: k for k, v in stages.items() for f in v['outputs']}
+    return {k: {producers[f] for f in get_filepaths(v.get('inputs', []))
+                if f in producers and producers[f] != k}
+            for k, v in stages.items()}
+
+def run_stage(name, stage, logdir=None):
+    """
+    Run stage commands in order, and return True if all succeed.
+    Output is written to a log file per stage if logdir is set
+
+    :param name: stage name
+    :param stage: stage dict with 'commands'
+    :param logdir: log file directory
+    """
+    fout = None
+    if logdir is not None:
+        os.makedirs(logdir, exist_ok=True)
+        fout = open(f'{logdir}/{name}.log', 'w', encoding='utf-8')
+    try:
+        for command in stage['commands']:
+            r = subprocess.run(get_command(command), stdout=fout, stderr=subprocess.STDOUT,
+                               check=False)
+            if r.returncode != 0:
+                return False
+        return True
+    finally:
+        if fout is not None:
+            fout.close()
+
+def run_pipeline(stages, processes=1, sources=(), force=(), dryrun=False, logdir=None,
+                 statepath=STATEPATH):
+    """
+    Run pipeline stages whose commands, parameters, inputs or shared sources
+    have changed, or whose outputs are missing, after the stages that produce
+    their inputs. Stages that do not depend on each other run concurrently.
+    Return dict of stage name and 'ok', 'run', 'fail' or 'skip' status
+
+    :param stages: dict of stage name and stage dict with 'commands', 'inputs' and 'outputs'
+    :param processes: maximum number of concurrent stages
+    :param sources: list of filepath glob patterns shared by all stages
+    :param force: stage names to run regardless of state
+    :param dryrun: report stages that would run without running them
+    :param logdir: per stage log file directory, stdout if None
+    :param statepath: state filepath
+    """
+    state = read_state(statepath)
+    upstream = get_upstream(stages)
+    status = {}
+
+    def get_ready():
+        return [k for k in stages if k not in status
+                and all(status.get(i) in ('ok', 'run') for i in upstream[k])]
+
+    def set_blocked():
+        for k in stages:
+            if k not in status and any(status.get(i) in ('fail', 'skip') for i in upstream[k]):
+                status[k] = 'skip'
+                print(f'Skip {k}')
+
+    with ThreadPoolExecutor(max(1, processes)) as pool:
+        running = {}
+        while True:
+            for k in get_ready():
+                stage = stages[k]
+                key = get_stagekey(stage, state, sources)
+                outputs = all(os.path.exists(f) for f in stage['outputs'])
+                rebuild = any(status.get(i) == 'run' for i in upstream[k])
+                if not rebuild and k not in force and outputs and \
+                   state['stages'].get(k) == key:
+                    status[k] = 'ok'
+                    print(f'Up to date {k}')
+                    continue
+                status[k] = 'pending'
+                print(f'Run {k}')
+                if dryrun:
+                    status[k] = 'run'
+                    continue
+                running[pool.submit(run_stage, k, stage, logdir)] = k
+            if not running:
+                set_blocked()
+                if get_ready():
+                    continue
+                if len(status) < len(stages):
+                    raise ValueError('pipeline stage inputs are cyclic')
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                k = running.pop(future)
+                if future.result():
+                    status[k] = 'run'
+                    state['stages'][k] = get_stagekey(stages[k], state, sources)
+                    write_state(state, statepath)
+                    print(f'Done {k}')
+                else:
+                    status[k] = 'fail'
+                    print(f'Fail {k}')
+            set_blocked()
+    if not dryrun:
+        write_state(state, statepath)
+    return status
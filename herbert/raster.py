@@ -0,0 +1,89 @@
+"""
+Module with RegularGrid raster layer write and read functions
+"""
+
+import os
+from glob import glob
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from .geometry import CRS, RegularGrid
+
+def get_rasterpath(filepath, layer, i=None):
+    """
+    Return GeoTIFF filepath for region i of a layer, in a directory named
+    after the GeoPKG filepath, or a glob pattern for all regions if i is None
+
+    :param filepath: GeoPKG filepath
+    :param layer: layer name
+    :param i: region index
+    """
+    stub = os.path.splitext(filepath)[0]
+    name = layer.replace(' ', '-')
+    suffix = '*' if i is None else str(i).zfill(3)
+    return f'{stub}/{name}-{suffix}.tif'
+
+def write_raster(grid, filepath, columns, crs=CRS, blocksize=256):
+    """
+    Write RegularGrid attributes as tiled, compressed GeoTIFF bands.
+    Cells that are not valid are NaN
+
+    :param grid: RegularGrid
+    :param filepath: GeoTIFF filepath
+    :param columns: dict of band name and grid attribute name
+    :param crs: geographic projection code
+    :param blocksize: tile edge size
+    """
+    if os.path.dirname(filepath):
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+    sx, sy = grid.spacing
+    m, n = grid.shape
+    transform = from_origin(grid.x[0] - sx / 2.0, grid.y[-1] + sy / 2.0, sx, sy)
+    profile = {'driver': 'GTiff', 'width': m, 'height': n, 'count': len(columns),
+               'dtype': 'float64', 'crs': crs, 'transform': transform, 'nodata': np.nan,
+               'tiled': True, 'blockxsize': blocksize, 'blockysize': blocksize,
+               'compress': 'deflate', 'predictor': 3}
+    with rasterio.open(filepath, 'w', **profile) as fout:
+        for j, (k, v) in enumerate(columns.items(), start=1):
+            fout.write(grid.get_raster(v, np.nan).astype(float).T[::-1], j)
+            fout.set_band_description(j, k)
+        fout.update_tags(d=grid.d)
+
+def read_raster(filepath):
+    """
+    Return RegularGrid with attributes read from GeoTIFF bands.
+    Cells are valid where any band is not NaN
+
+    :param filepath: GeoTIFF filepath
+    """
+    with rasterio.open(filepath) as fin:
+        sx, sy = fin.res
+        west, north = fin.transform.c, fin.transform.f
+        x_linear = west + (np.arange(fin.width) + 0.5) * sx
+        y_linear = north - (np.arange(fin.height)[::-1] + 0.5) * sy
+        bands = {k: fin.read(j).T[:, ::-1] for j, k in enumerate(fin.descriptions, start=1)}
+        d = fin.tags().get('d')
+    mask = np.any([~np.isnan(v) for v in bands.values()], axis=0)
+    grid = RegularGrid(x_linear, y_linear, mask, None if d in (None, 'None') else float(d))
+    for k, v in bands.items():
+        grid[k] = v[mask]
+    return grid
+
+def read_rasters(filepath, layer, columns=None):
+    """
+    Return 2D numpy point array and dict of attribute arrays for all region
+    GeoTIFF files of a layer
+
+    :param filepath: GeoPKG filepath
+    :param layer: layer name
+    :param columns: attribute names, all if None
+    """
+    pattern = get_rasterpath(filepath, layer)
+    grids = [read_raster(i) for i in sorted(glob(pattern))]
+    if not grids:
+        raise FileNotFoundError(f'no region GeoTIFF files match {pattern}')
+    if columns is None:
+        columns = list(grids[0].data)
+    points = np.concatenate([grid.points for grid in grids])
+    data = {k: np.concatenate([grid[k] for grid in grids]) for k in columns}
+    return points, data
@@ -0,0 +1,286 @@
+"""
+Module with GeoPKG layer read and write functions
+"""
+
+import os
+import json
+import sqlite3
+from contextlib import closing
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_integer_dtype
+import geopandas as gp
+import shapely
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pyogrio
+from pyogrio import read_dataframe, read_info
+from .base import SCHEMA, reduce_mem_usage, replace_file
+from .geometry import CRS
+
+KEY = b'herbert'
+
+# pyogrio reads and writes through Arrow where built against GDAL >= 3.8
+ARROW = {'use_arrow': True} if pyogrio.__gdal_version__ >= (3, 8, 0) else {}
+
+def to_crs(gf, crs=CRS):
+    """
+    Return GeoDataFrame in crs, only reprojecting if its CRS differs
+
+    :param gf: GeoDataFrame
+    :param crs: geographic projection code
+    """
+    if gf.crs == crs:
+        return gf
+    return gf.to_crs(crs)
+
+def get_sidecarpath(filepath, layer):
+    """
+    Return filepath of GeoParquet sidecar stored next to GeoPKG layer
+
+    :param filepath: GeoPKG filepath
+    :param layer: layer name
+    """
+    stub = os.path.splitext(filepath)[0]
+    return f'{stub}-{layer}.parquet'
+
+def get_layerkey(filepath, layer):
+    """
+    Return string that changes whenever GeoPKG layer is rewritten, from the
+    layer last change time and feature count, or the file modification time
+    and size if these are not available
+
+    :param filepath: GeoPKG filepath
+    :param layer: layer name
+    """
+    try:
+        with closing(sqlite3.connect(f'file:{filepath}?mode=ro', uri=True)) as con:
+            r = con.execute('SELECT c.last_change, o.feature_count FROM gpkg_contents c '
+                            'LEFT JOIN gpkg_ogr_contents o ON c.table_name = o.table_name '
+                            'WHERE c.table_name = ?', (layer,)).fetchone()
+        if r is not None:
+            return f'{r[0]}:{r[1]}'
+    except sqlite3.Error:
+        pass
+    stat = os.stat(filepath)
+    return f'{stat.st_mtime_ns}:{stat.st_size}'
+
+def get_sidecarkey(filepath):
+    """
+    Return source layer key stored in GeoParquet sidecar, or None if missing
+
+    :param filepath: GeoParquet filepath
+    """
+    try:
+        metadata = pq.read_schema(filepath).metadata or {}
+    except (FileNotFoundError, pa.ArrowInvalid):
+        return None
+    return metadata.get(KEY, b'').decode() or None
+
+def write_sidecar(gf, filepath, key):
+    """
+    Write GeoDataFrame as GeoParquet with WKB geometry, hidden '_x' and '_y'
+    centroid columns and source layer key, through a unique temporary file
+
+    :param gf: GeoDataFrame
+    :param filepath: GeoParquet filepath
+    :param key: source layer key
+    """
+    name = gf.geometry.name
+    geometry = np.asarray(gf.geometry.values)
+    df = pd.DataFrame(gf.drop(columns=name))
+    df['_x'], df['_y'] = shapely.get_coordinates(shapely.centroid(geometry)).T
+    df[name] = shapely.to_wkb(geometry)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    geo = {'version': '1.0.0', 'primary_column': name,
+           'columns': {name: {'encoding': 'WKB', 'geometry_types': [],
+                              'crs': gf.crs.to_json_dict() if gf.crs else None}}}
+    metadata = {**(table.schema.metadata or {}), b'geo': json.dumps(geo).encode(),
+                KEY: key.encode()}
+    with replace_file(filepath) as fout:
+        pq.write_table(table.replace_schema_metadata(metadata), fout)
+
+def read_sidecar(filepath, columns=None, geometry='geometry', crs=CRS):
+    """
+    Return GeoDataFrame read from GeoParquet sidecar through a memory map,
+    reading only the columns needed.
+    Geometry is 'geometry' for the stored geometry, 'centroid' for centroid
+    points without parsing the stored geometry, or None for a DataFrame
+
+    :param filepath: GeoParquet filepath
+    :param columns: attribute columns, all if None
+    :param geometry: 'geometry', 'centroid' or None
+    :param crs: geographic projection code
+    """
+    schema = pq.read_schema(filepath)
+    name = json.loads(schema.metadata[b'geo'])['primary_column']
+    if columns is None:
+        columns = [i for i in schema.names if i not in (name, '_x', '_y')]
+    keys = {'geometry': [name], 'centroid': ['_x', '_y'], None: []}[geometry]
+    df = pq.read_table(filepath, columns=list(columns) + keys, memory_map=True).to_pandas()
+    if geometry is None:
+        return df
+    if geometry == 'centroid':
+        r = shapely.points(df.pop('_x').values, df.pop('_y').values)
+    else:
+        r = shapely.from_wkb(df.pop(name).values)
+    source = json.loads(schema.metadata[b'geo'])['columns'][name]['crs']
+    gf = gp.GeoDataFrame(data=df, geometry=gp.GeoSeries(r, index=df.index, crs=source))
+    return to_crs(gf, crs)
+
+def update_sidecar(filepath, layer, gf=None):
+    """
+    Write GeoParquet sidecar for GeoPKG layer if it is missing or stale,
+    from gf if given otherwise by reading the layer, and return its filepath
+
+    :param filepath: GeoPKG filepath
+    :param layer: layer name
+    :param gf: GeoDataFrame as just written to layer
+    """
+    key = get_layerkey(filepath, layer)
+    sidecarpath = get_sidecarpath(filepath, layer)
+    if get_sidecarkey(sidecarpath) != key:
+        if gf is None:
+            gf = read_dataframe(filepath, layer=layer, **ARROW)
+        write_sidecar(gf, sidecarpath, key)
+    return sidecarpath
+
+def read_gf(filepath, layer, columns=None, geometry='geometry', crs=CRS, schema=SCHEMA):
+    """
+    Return GeoDataFrame read from GeoPKG layer through its GeoParquet sidecar,
+    creating or refreshing the sidecar when the layer has changed.
+    Geometry is 'geometry' for the layer geometry, 'centroid' for centroid
+    points without parsing the layer geometry, or None for a DataFrame.
+    Columns in schema are compacted where no value changes
+
+    :param filepath: GeoPKG filepath
+    :param layer: layer name
+    :param columns: attribute columns, all if None
+    :param geometry: 'geometry', 'centroid' or None
+    :param crs: geographic projection code
+    :param schema: dict of column and compact dtype, None to keep read dtypes
+    """
+    r = read_sidecar(update_sidecar(filepath, layer), columns, geometry, crs)
+    if schema is None:
+        return r
+    return reduce_mem_usage(r, output=False, schema=schema)
+
+def read_region(filepath, layer, boundary=None, margin=0.0, where=None, columns=None,
+                crs=CRS, bbox=None, schema=SCHEMA):
+    """
+    Return GeoDataFrame of GeoPKG layer features within margin of a boundary
+    geometry or bbox, reading only features whose bounding box intersects it
+    through the layer R-tree spatial index, and that match an attribute
+    SQL where filter. Columns in schema are compacted where no value changes
+
+    :param filepath: GeoPKG filepath
+    :param layer: layer name
+    :param boundary: boundary geometry in crs
+    :param margin: distance from boundary or bbox
+    :param where: SQL WHERE attribute filter
+    :param columns: attribute columns, all if None
+    :param crs: geographic projection code
+    :param bbox: (minx, miny, maxx, maxy) bounds in crs, used if boundary is None
+    :param schema: dict of column and compact dtype, None to keep read dtypes
+    """
+    if boundary is not None:
+        bbox = shapely.bounds(boundary)
+    if bbox is not None:
+        bbox = np.asarray(bbox, dtype=float) + [-margin, -margin, margin, margin]
+        source = read_info(filepath, layer=layer)['crs']
+        if source is not None:
+            bbox = gp.GeoSeries([shapely.box(*bbox)], crs=crs).to_crs(source).total_bounds
+        bbox = tuple(bbox)
+    gf = read_dataframe(filepath, layer=layer, columns=columns, where=where, bbox=bbox)
+    gf = to_crs(gf, crs)
+    if boundary is not None:
+        gf = gf[shapely.dwithin(np.asarray(gf.geometry.values), boundary, margin)]
+    if schema is None:
+        return gf
+    return reduce_mem_usage(gf, output=False, schema=schema)
+
+def write_gf(gf, filepath, layer, crs=CRS, append=False, sidecar=False):
+    """
+    Write GeoDataFrame layer to GeoPKG filepath through pyogrio in a single
+    transaction, using Arrow where available.
+    Replace any existing layer unless append
+
+    :param gf: GeoDataFrame
+    :param filepath: GeoPKG filepath
+    :param layer: layer name
+    :param crs: geographic projection code
+    :param append: append to existing layer
+    :param sidecar: also write GeoParquet sidecar, not written when appending
+    """
+    mode = 'a' if append else 'w'
+    gf = to_crs(gf, crs)
+    gf.to_file(filepath, driver='GPKG', layer=layer, engine='pyogrio', mode=mode, **ARROW)
+    if sidecar and not append:
+        index = list(gf.index.names) != [None] or not is_integer_dtype(gf.index.dtype)
+        update_sidecar(filepath, layer, gf.reset_index() if index else gf)
+
+class GeoPKGBuffer:
+    """
+    Buffer GeoDataFrame layers in memory and write each layer to a GeoPKG
+    in large batches through write_gf, without reprojecting frames already
+    in the target CRS. Each batch reopens the GeoPKG and is written in one
+    transaction. Buffered layers are written when a batch fills, on flush or
+    on close. Where sidecar is set every layer also has a GeoParquet sidecar
+    on close
+    """
+
+    def __init__(self, filepath, crs=CRS, batchsize=2**18, sidecar=False):
+        """
+        :param filepath: GeoPKG filepath
+        :param crs: geographic projection code
+        :param batchsize: number of buffered rows that triggers a layer write
+        :param sidecar: write GeoParquet sidecar for each layer
+        """
+        self.filepath = filepath
+        self.crs = crs
+        self.batchsize = batchsize
+        self.sidecar = sidecar
+        self.buffer = {}
+        self.layers = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, gf, layer):
+        """
+        Add GeoDataFrame to layer buffer, and write layer if batch is full
+
+        :param gf: GeoDataFrame
+        :param layer: layer name
+        """
+        frames = self.buffer.setdefault(layer, [])
+        frames.append(to_crs(gf, self.crs))
+        if sum(len(i) for i in frames) >= self.batchsize:
+            self.flush(layer)
+
+    def flush(self, layer=None):
+        """
+        Write buffered layer, or all buffered layers if layer is None
+
+        :param layer: layer name
+        """
+        layers = list(self.buffer) if layer is None else [layer]
+        for k in layers:
+            frames = self.buffer.pop(k, [])
+            if not frames:
+                continue
+            gf = frames[0] if len(frames) == 1 else pd.concat(frames)
+            write_gf(gf, self.filepath, k, self.crs, k in self.layers, self.sidecar)
+            self.layers.add(k)
+
+    def close(self):
+        """
+        Write all buffered layers, and sidecars of layers written in batches
+        """
+        self.flush()
+        if self.sidecar:
+            for k in self.layers:
+                update_sidecar(self.filepath, k)
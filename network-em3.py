@@ -9,17 +9,16 @@ import pandas as pd
 import geopandas as gp
 
 from shapely.validation import make_valid
-from shapely.geometry import LineString, Polygon
+from shapely.geometry import Polygon
 
 from scipy.spatial.distance import pdist
 
 from libpysal.weights import Delaunay, Gabriel
 from libpysal.cg import voronoi_frames
 
-import networkx as nx
-import momepy
-
+import herbert.geometry as hg
 from herbert.base import archive
+from herbert.network import Graph, PathCache
 
 def get_cityblock(gf1):
     r = gf1.bounds.to_numpy().T
@@ -90,41 +89,28 @@ TOWNS['name'] = 'T' + (TOWNS.index + 1).astype(str).str.zfill(3)
 
 POINTS = TOWNS['geometry']
 
-def get_wnx(gx, points=POINTS):
-    try:
-        edges = [LineString(points[np.array(i)]) for i in gx.edges]
-    except KeyError:
-        return get_wnx(gx, points.values)
-    return gp.GeoSeries(edges).rename('geometry').set_crs(CRS)
-
 def get_links(df1, df2=TOWNS, k='em class'):
     v = df1[['source', 'target']].to_numpy().reshape(-1)
     return df2.loc[v, k].values.reshape(-1, 2)
 
-def get_paths(mx, links, weight='weight', points=CENTRES):
-    r = [nx.shortest_path(mx, *(i), weight=weight) for i in links]
-    return [LineString(points.loc[j, 'geometry'].values) for j in r]
-
 print('Create network')
-CX = nx.complete_graph(TOWNS.shape[0])
-DF1 = nx.to_pandas_edgelist(CX)
-DF1[['source name', 'target name']] = TOWNS['name'].values[DF1[['source', 'target']].to_numpy().reshape(-1)].reshape(-1, 2)
-GF1 = gp.GeoDataFrame(data=DF1, geometry=get_wnx(CX))
-GF1['distance'] = GF1.length
+CX = Graph(*np.triu_indices(TOWNS.shape[0], 1), TOWNS.index, hg.get_points(POINTS))
+GF1 = CX.to_frame(CRS, 'distance')
+GF1.insert(2, 'source name', TOWNS['name'].values[GF1['source']])
+GF1.insert(3, 'target name', TOWNS['name'].values[GF1['target']])
 
-NX = momepy.gdf_to_nx(GF1, approach='primal')
+NX = Graph.from_frame(GF1, nodes=TOWNS.index)
 
 def get_mst(k, network=NX):
-    gx = nx.minimum_spanning_tree(network, weight=k)
-    nodes, edges = momepy.nx_to_gdf(gx, points=True, lines=True)
-    return nodes, edges
+    gx = network.minimum_spanning_tree(k)
+    return gx, gx.to_frame(CRS)
 
 FILEPATH = 'network-em.gpkg'
 for key in ['distance']:
-    _, MST = get_mst(key)
+    TREE, MST = get_mst(key)
     MST.to_crs(CRS).to_file(FILEPATH, driver='GPKG', layer=f'MST {key}')
 
-DS1 = pd.concat([MST['source'], MST['target']]).rename('node').reset_index().groupby('node').count()['index'].rename('n')
+DS1 = pd.Series(TREE.get_degree(), index=TREE.nodes, name='n')
 DS2 = TOWNS['em class']
 
 GF1['n source'] = DS1.values.reshape(-1)[GF1['source']]
@@ -196,38 +182,31 @@ NX = pd.concat([CENTRES, EXTERIOR]).reset_index(drop=True)
 NX.to_crs(CRS).to_file(FILEPATH, driver='GPKG', layer='NX')
 
 DELAUNAY = Delaunay.from_dataframe((NX))
-DX = DELAUNAY.to_networkx()
-DF2 = nx.to_pandas_edgelist(DX)[['source', 'target']]
-EDGES = gp.GeoDataFrame(get_wnx(DX, NX['geometry']))
-EDGES = EDGES.join(DF2)
+EDGES = Graph.from_weights(DELAUNAY, NX).to_frame(CRS, 'distance')
 EDGES['source'] = NX['em class'].values[EDGES['source']]
 EDGES['target'] = NX['em class'].values[EDGES['target']]
 EDGES.to_crs(CRS).to_file(FILEPATH, driver='GPKG', layer='D1')
 IDX3 = EDGES[(EDGES['source'] > -1) & (EDGES['target'] > -1)].index
 EDGES = EDGES.loc[IDX3]
-EDGES['distance'] = EDGES.length
 EDGES.to_crs(CRS).to_file(FILEPATH, driver='GPKG', layer='D2')
 
-MX = nx.from_pandas_edgelist(EDGES, edge_attr='distance')
+MX = PathCache.from_frame(EDGES, 'distance')
 LINKS = get_links(MST)
-PATHS = gp.GeoDataFrame(data=LINKS, columns=['source', 'target'], geometry=get_paths(MX, LINKS, 'distance'))
+LINES, _ = MX.get_lines(LINKS, CENTRES['geometry'], CRS)
+PATHS = gp.GeoDataFrame(data=LINKS, columns=['source', 'target'], geometry=LINES)
 
 PATHS = PATHS.set_crs(CRS)
 PATHS.to_crs(CRS).to_file(FILEPATH, driver='GPKG', layer='paths')
 
 GABRIEL = Gabriel.from_dataframe(HUBS)
-GX = GABRIEL.to_networkx()
-DF2 = nx.to_pandas_edgelist(GX)[['source', 'target']]
-EDGES = gp.GeoDataFrame(get_wnx(GX, HUBS['geometry']))
-EDGES = EDGES.join(DF2)
+EDGES = Graph.from_weights(GABRIEL, HUBS).to_frame(CRS, 'distance')
 EDGES['source'] = HUBS['em class'].values[EDGES['source']]
 EDGES['target'] = HUBS['em class'].values[EDGES['target']]
-EDGES['distance'] = EDGES.length
 EDGES.to_crs(CRS).to_file(FILEPATH, driver='GPKG', layer='GX')
 
-EX = nx.from_pandas_edgelist(EDGES, edge_attr='distance')
-LINKS = np.array(EX.edges)
-PATHS = gp.GeoDataFrame(data=LINKS, columns=['source', 'target'], geometry=get_paths(MX, LINKS, 'distance'))
+LINKS = EDGES[['source', 'target']].values
+LINES, _ = MX.get_lines(LINKS, CENTRES['geometry'], CRS)
+PATHS = gp.GeoDataFrame(data=LINKS, columns=['source', 'target'], geometry=LINES)
 
 PATHS = PATHS.set_crs(CRS)
 PATHS.to_crs(CRS).to_file(FILEPATH, driver='GPKG', layer='routes')
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""Rebuild pipeline outputs whose scripts, parameters or inputs have changed"""
+import datetime as dt
+import argparse
+
+from herbert.pipeline import run_pipeline
+
+JOBS = 2
+FORCE = []
+DRYRUN = False
+LOGDIR = None
+REGION = 'em'
+P = 10.0E3
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='rebuild pipeline stages with changed scripts, parameters or inputs')
+    parser.add_argument('stages', type=str, nargs='*',
+                        help='stage names to rebuild regardless of state', default=[])
+    parser.add_argument('-j', dest='jobs', type=int,
+                        help='number of concurrent stages', default=2)
+    parser.add_argument('-n', dest='dryrun', action='store_true',
+                        help='list stages that would be rebuilt')
+    parser.add_argument('-l', dest='logdir', type=str,
+                        help='write stage output to log files in directory', default=None)
+    parser.add_argument('-p', dest='population', type=float,
+                        help='clusters2 population centre', default=10.0E3)
+
+    args = parser.parse_args()
+    JOBS = args.jobs
+    FORCE = args.stages
+    DRYRUN = args.dryrun
+    LOGDIR = args.logdir
+    P = args.population
+
+START = dt.datetime.now()
+
+SOURCES = ['herbert/*.py']
+
+# geography.py writes the OA layer k-d tree and GeoParquet sidecar caches, so
+# stages that run at the same time only read them
+
+STAGES = {
+    'geography': {
+        'commands': [['geography.py']],
+        'inputs': ['data/OA-DZ-lookup.tsv', 'data/Mid-2020-scotland.csv',
+                   'data/OA-2011-boundaries-SC-BFC.gpkg', 'data/OA-MS-LS.csv',
+                   'data/OA-2011-boundaries-EW-BFC.gpkg', 'data/Mid-2020-*.tsv'],
+        'outputs': ['geography.gpkg', 'grid.gpkg', 'grid-hierarchy.npz', 'britain.gpkg',
+                    'geography-OA.parquet', 'grid-OA.parquet', 'grid-OA.kdtree'],
+    },
+    'batchkmeans7': {
+        'commands': [['batchkmeans7.py']],
+        'inputs': ['geography.gpkg', 'geography-OA.parquet', 'grid.gpkg', 'grid-hierarchy.npz'],
+        'outputs': ['bkm64.gpkg'],
+    },
+    'heatmap4': {
+        'commands': [['heatmap4.py'], ['heatmaps.sh']],
+        'inputs': ['bkm64.gpkg', 'grid.gpkg', 'grid-OA.parquet', 'grid-OA.kdtree'],
+        'outputs': ['heatmap.gpkg'],
+    },
+    'east-midlands': {
+        'commands': [['east-midlands.py'], ['eastmidlands.sh']],
+        'inputs': ['bkm64.gpkg', 'grid.gpkg', 'grid-OA.parquet', 'grid-OA.kdtree'],
+        'outputs': ['east-midlands.gpkg'],
+    },
+    'batchkmeans-em': {
+        'commands': [['batchkmeans-em.py']],
+        'inputs': ['east-midlands.gpkg'],
+        'outputs': ['em-grid.gpkg'],
+    },
+    'clusters2': {
+        'commands': [['clusters2.py', REGION, '-p', str(P)]],
+        'inputs': [f'{REGION}-grid.gpkg'],
+        'outputs': [f'clusters-{REGION}-{int(P / 1.0E3)}k.gpkg'],
+    },
+}
+
+if __name__ == '__main__':
+    STATUS = run_pipeline(STAGES, JOBS, SOURCES, FORCE, DRYRUN, LOGDIR)
+    print(dt.datetime.now() - START)
+    if 'fail' in STATUS.values():
+        raise SystemExit(1)
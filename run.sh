@@ -95,31 +95,7 @@ if [ ! -s data/${FILE} ]; then
     ogr2ogr -f GPKG data/${STUB}.gpkg data/${STUB}.geojson -t_srs EPSG:32630
 fi
 
-if [ ! -s geography.gpkg ]; then
-    ./geography.py
-fi
-
-if [ ! -s bkm64.gpkg ]; then
-    ./batchkmeans7.py
-fi
-
-if [ ! -s heatmap.gpkg ]; then
-    ./heatmap4.py
-    ./heatmaps.sh
-fi
-
-if [ ! -s east-midlands.gpkg ]; then
-    ./east-midlands.py
-    ./eastmidlands.sh
-fi
-
-if [ ! -s em-grid.gpkg ]; then
-    ./batchkmeans-em.py
-fi
-
-if [ ! -s clusters-em-10k.gpkg ]; then
-    ./clusters2.py
-fi
+./pipeline.py
 
 if [ ! -s SHP/routes.shp ]; then
     ogr2ogr SHP/ network-em-10k.gpkg -t_srs EPSG:4277
@@ -0,0 +1,48 @@
+import networkx as nx
+import numpy as np
+
+import herbert.flow as hf
+
+def get_graph():
+    graph = nx.DiGraph()
+    graph.add_edge('s', 'a', capacity=3)
+    graph.add_edge('a', 't', capacity=5)
+    graph.add_edge('s', 'b', capacity=2)
+    graph.add_edge('b', 't', capacity=1)
+    graph.add_edge('t', 'c', capacity=4)
+    graph.add_edge('c', 'd', capacity=2)
+    return graph
+
+PAIRS = [('s', 't'), ('s', 'd'), ('a', 'c'), ('t', 's'), ('b', 'd')]
+
+def test_flow_backends():
+    graph = get_graph()
+    values, flows = hf.get_flows(graph, PAIRS, backend='networkx')
+    assert np.array_equal(values, [4, 2, 4, 0, 1])
+    for backend in hf.BACKENDS:
+        for processes in [1, 2]:
+            r, s = hf.get_flows(graph, PAIRS, processes, backend)
+            assert np.array_equal(r, values)
+            assert np.array_equal(s.toarray(), flows.toarray())
+
+def test_flow_edges():
+    graph = get_graph()
+    _, flows = hf.get_flows(graph, PAIRS[:1], backend='csgraph')
+    assert flows.shape == (1, graph.number_of_edges())
+    assert np.array_equal(flows.toarray(), [[3, 1, 3, 0, 1, 0]])
+
+def test_legflows():
+    graph = get_graph()
+    _, flows = hf.get_flows(graph, PAIRS, backend='csgraph')
+    legflows = hf.get_legflows(flows, np.asarray([1, 5, 1]))
+    assert np.array_equal(legflows.toarray(), flows.toarray()[:, [1, 5, 1]].T)
+    groupflows = hf.get_groupflows(legflows, np.asarray([0, 1, 0]))
+    assert np.array_equal(groupflows.toarray()[0], 2 * flows.toarray()[:, 1])
+
+def test_check_flows():
+    assert np.array_equal(hf.check_flows(get_graph(), PAIRS), [4, 2, 4, 0, 1])
+
+def test_no_pairs():
+    values, flows = hf.get_flows(get_graph(), [], backend='csgraph')
+    assert values.shape == (0,)
+    assert flows.shape == (0, 6)
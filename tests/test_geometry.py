@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import geopandas as gp
+import shapely
+
+from herbert.geometry import RegularGrid, dissolve
+
+def test_single_row_grid():
+    grid = RegularGrid([0.0, 10.0, 20.0, 30.0], [5.0], d=10.0)
+    grid['population'] = [1, 2, 3, 4]
+    assert np.array_equal(grid.spacing, [10.0, 10.0])
+    points = np.asarray([[0.0, 5.0], [21.0, 7.0], [30.0, 40.0], [-20.0, 5.0]])
+    assert np.array_equal(grid.get_cells(points), [0, 2, -1, -1])
+    subgrid = grid.get_subgrid(grid['population'] > 2)
+    assert np.array_equal(subgrid.points, [[20.0, 5.0], [30.0, 5.0]])
+    assert np.array_equal(subgrid['population'], [3, 4])
+    coarse = grid.coarsen(2)
+    assert coarse.shape == (2, 1)
+    assert np.array_equal(coarse.x, [5.0, 25.0])
+    assert np.array_equal(coarse['population'], [3, 7])
+    assert np.array_equal(coarse.spacing, [20.0, 20.0])
+
+def test_single_column_grid():
+    grid = RegularGrid([5.0], [0.0, 10.0, 20.0], d=10.0)
+    assert np.array_equal(grid.spacing, [10.0, 10.0])
+    assert np.array_equal(grid.get_cells(np.asarray([[5.0, 19.0]])), [2])
+
+def get_boxes():
+    geometry = shapely.box(np.arange(5.0), 0.0, np.arange(5.0) + 1.0, 1.0)
+    return gp.GeoDataFrame({'key': ['a', 'a', None, 'b', 'b'], 'value': [1, 2, 3, 4, 5]},
+                           geometry=geometry)
+
+def test_dissolve_missing_key():
+    gf = get_boxes()
+    for processes in [1, 2]:
+        r = dissolve(gf, 'key', aggfunc='sum', processes=processes)
+        assert r.index.to_list() == ['a', 'b']
+        assert r['value'].to_list() == [3, 9]
+        assert np.allclose(r.area, [2.0, 2.0])
+        assert r.geom_equals(gf.dissolve('key', aggfunc='sum').geometry).all()
+
+def test_dissolve_categorical_key():
+    gf = get_boxes().astype({'key': pd.CategoricalDtype(['a', 'b', 'c'])})
+    r = dissolve(gf, 'key', aggfunc='sum')
+    assert r.index.to_list() == ['a', 'b']
+    assert r['value'].to_list() == [3, 9]
+    assert np.allclose(r.area, [2.0, 2.0])